@@ -0,0 +1,104 @@
+"""Context of the module code, which is currently running"""
+
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+import contextlib
+import contextvars
+import typing
+
+from .types import Module
+
+# Context variables are copied to tasks on creation, so the module
+# stays known in tasks, started by its handlers
+current_module: contextvars.ContextVar = contextvars.ContextVar(
+    "hikka_current_module",
+    default=None,
+)
+current_client: contextvars.ContextVar = contextvars.ContextVar(
+    "hikka_current_client",
+    default=None,
+)
+current_command: contextvars.ContextVar = contextvars.ContextVar(
+    "hikka_current_command",
+    default=None,
+)
+current_message_id: contextvars.ContextVar = contextvars.ContextVar(
+    "hikka_current_message_id",
+    default=None,
+)
+
+
+def get_module(func: typing.Callable) -> typing.Optional[Module]:
+    """
+    Get module, which the handler belongs to
+    :param func: Handler (bound method of module)
+    :return: Module or `None` if handler is not a method of module
+    """
+    module = getattr(func, "__self__", None)
+    return module if isinstance(module, Module) else None
+
+
+def get_client_id() -> typing.Optional[int]:
+    """
+    Get id of the client, which the running code belongs to
+    :return: Telegram id of client or `None` if it's unknown
+    """
+    if (tg_id := getattr(current_module.get(), "tg_id", None)) is not None:
+        return tg_id
+
+    return getattr(current_client.get(), "tg_id", None)
+
+
+@contextlib.contextmanager
+def enter_module(module: typing.Optional[Module]):
+    """
+    Mark the code inside as run by the module
+    :param module: Module, which code is run, or `None` if it's unknown
+    """
+    token = current_module.set(module)
+    try:
+        yield
+    finally:
+        current_module.reset(token)
+
+
+@contextlib.contextmanager
+def enter_client(client: typing.Any):
+    """
+    Mark the code inside as run on behalf of the client
+    :param client: :obj:`CustomTelegramClient`, which code is run
+    """
+    token = current_client.set(client)
+    try:
+        yield
+    finally:
+        current_client.reset(token)
+
+
+@contextlib.contextmanager
+def enter_request(
+    client: typing.Any,
+    func: typing.Callable,
+    message: typing.Optional[typing.Any] = None,
+):
+    """
+    Mark the code inside as processing of the message by the handler
+    :param client: :obj:`CustomTelegramClient`, which received the message
+    :param func: Command or watcher, which processes the message
+    :param message: Message, which is processed
+    """
+    tokens = (
+        (current_client, current_client.set(client)),
+        (current_module, current_module.set(get_module(func))),
+        (current_command, current_command.set(func)),
+        (current_message_id, current_message_id.set(getattr(message, "id", None))),
+    )
+    try:
+        yield
+    finally:
+        for var, token in reversed(tokens):
+            var.reset(token)
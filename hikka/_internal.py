@@ -11,12 +11,52 @@ import os
 import random
 import signal
 import sys
+import typing
+
+_shutdown_callbacks: typing.List[typing.Callable[[], None]] = []
 
 
 async def fw_protect():
     await asyncio.sleep(random.randint(1000, 3000) / 1000)
 
 
+def on_shutdown(callback: typing.Callable[[], None]):
+    """
+    Register callback, which must run before the process is replaced or killed.
+    Restart replaces the process with `os.execl` and SIGTERM kills it, neither
+    of them runs `atexit` handlers reliably, so callbacks are run explicitly
+    :param callback: Synchronous function without arguments
+    """
+    if not _shutdown_callbacks:
+        atexit.register(run_shutdown_callbacks)
+        try:
+            # Handled by event loop, so callbacks never interrupt the code,
+            # which is changing the same data
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, _terminate)
+        except RuntimeError:
+            signal.signal(signal.SIGTERM, _terminate)
+        except (NotImplementedError, ValueError):
+            # Not supported on this platform or not in the main thread
+            pass
+
+    _shutdown_callbacks.append(callback)
+
+
+def run_shutdown_callbacks():
+    """Run callbacks, registered with :func:`on_shutdown`"""
+    for callback in _shutdown_callbacks:
+        try:
+            callback()
+        except Exception:
+            logging.getLogger(__name__).exception("Shutdown callback failed")
+
+
+def _terminate(*_):
+    run_shutdown_callbacks()
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    os.kill(os.getpid(), signal.SIGTERM)
+
+
 def get_startup_callback() -> callable:
     return lambda *_: os.execl(
         sys.executable,
@@ -29,6 +69,8 @@ def get_startup_callback() -> callable:
 
 def die():
     """Platform-dependent way to kill the current process group"""
+    run_shutdown_callbacks()
+
     if "DOCKER" in os.environ:
         sys.exit(0)
     else:
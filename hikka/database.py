@@ -6,10 +6,14 @@
 
 import asyncio
 import collections
+import contextlib
 import json
 import logging
+import math
 import os
+import threading
 import time
+from pathlib import Path
 
 try:
     import redis
@@ -17,6 +21,16 @@ except ImportError as e:
     if "RAILWAY" in os.environ:
         raise e
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
 
 import typing
 
@@ -24,6 +38,7 @@ from hikkatl.errors.rpcerrorlist import ChannelsTooMuchError
 from hikkatl.tl.types import Message, User
 
 from . import main, utils
+from ._internal import on_shutdown
 from .pointers import (
     BaseSerializingMiddlewareDict,
     BaseSerializingMiddlewareList,
@@ -47,6 +62,140 @@ __all__ = [
 
 logger = logging.getLogger(__name__)
 
+# Journal is compacted into the main database file once it outgrows
+# both this size and the size of the main file itself
+JOURNAL_COMPACT_SIZE = 1024 * 1024
+# Key of the main database file, which holds the sequence number of the last
+# journal record, included in it. It is never exposed to the database users
+JOURNAL_MARKER = "__journal__"
+# Changes are written to disk in batches after this delay (in seconds)
+# or as soon as this many keys are changed, whichever comes first.
+# Both can be overridden with `db_save_delay` and `db_save_max_pending`
+# keys of the main module. Zero delay means writing changes right away
+SAVE_DELAY = 1.0
+SAVE_MAX_PENDING = 100
+
+
+def _has_non_finite(obj: typing.Any) -> bool:
+    """
+    Check if object contains `NaN` or infinite floats. Faster codecs write
+    them as `null`, while standard library writes them as is and reads back
+    :param obj: Object to check
+    :return: Whether there are such floats
+    """
+    stack = [obj]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, float):
+            if not math.isfinite(item):
+                return True
+        elif isinstance(item, dict):
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple)):
+            stack.extend(item)
+
+    return False
+
+
+class JSONCodec:
+    """Standard library JSON codec, which is used if no faster one is installed"""
+
+    name = "json"
+
+    def dumps(self, obj: typing.Any, pretty: bool = False) -> bytes:
+        """
+        Serialize object to JSON
+        :param obj: Object to serialize
+        :param pretty: Whether to indent output, so it can be edited by hand.
+            Otherwise, output is as compact as possible
+        :return: UTF-8 encoded JSON
+        """
+        if pretty:
+            return json.dumps(obj, indent=4, ensure_ascii=False).encode()
+
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+    def loads(self, data: typing.Union[bytes, str]) -> typing.Any:
+        """
+        Deserialize JSON
+        :raises json.decoder.JSONDecodeError: If data is not a valid JSON
+        """
+        return json.loads(data)
+
+
+class OrjsonCodec(JSONCodec):
+    """
+    JSON codec, backed by `orjson`. It's used only for writing, because
+    `orjson` silently reads integers, which don't fit in 64 bits, as floats
+    """
+
+    name = "orjson"
+
+    def dumps(self, obj: typing.Any, pretty: bool = False) -> bytes:
+        try:
+            data = orjson.dumps(
+                obj,
+                option=orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if pretty else 0),
+            )
+        except TypeError:
+            # E.g. integers, which don't fit in 64 bits
+            return super().dumps(obj, pretty)
+
+        # Objects are walked only if there could be lost non-finite floats
+        if b"null" in data and _has_non_finite(obj):
+            return super().dumps(obj, pretty)
+
+        return data
+
+
+class MsgspecCodec(JSONCodec):
+    """JSON codec, backed by `msgspec`"""
+
+    name = "msgspec"
+
+    def dumps(self, obj: typing.Any, pretty: bool = False) -> bytes:
+        try:
+            data = msgspec.json.encode(obj)
+        except (TypeError, OverflowError, msgspec.EncodeError):
+            return super().dumps(obj, pretty)
+
+        # Objects are walked only if there could be lost non-finite floats
+        if b"null" in data and _has_non_finite(obj):
+            return super().dumps(obj, pretty)
+
+        return msgspec.json.format(data, indent=4) if pretty else data
+
+    def loads(self, data: typing.Union[bytes, str]) -> typing.Any:
+        try:
+            return msgspec.json.decode(data)
+        except msgspec.DecodeError:
+            return super().loads(data)
+
+
+CODECS = {
+    codec.name: codec
+    for codec, available in (
+        (MsgspecCodec, msgspec),
+        (OrjsonCodec, orjson),
+        (JSONCodec, json),
+    )
+    if available
+}
+
+
+def get_codec(name: typing.Optional[str] = None) -> JSONCodec:
+    """
+    Get JSON codec for database
+    :param name: Name of the codec. If not passed, `HIKKA_DB_CODEC` environment
+        variable is used. Falls back to the fastest installed codec
+    :return: Codec instance
+    """
+    name = name or os.environ.get("HIKKA_DB_CODEC")
+    if name and name not in CODECS:
+        logger.warning("Database codec %s is not available", name)
+
+    return CODECS.get(name, next(iter(CODECS.values())))()
+
 
 class NoAssetsChannel(Exception):
     """Raised when trying to read/store asset with no asset channel present"""
@@ -56,28 +205,78 @@ class Database(dict):
     def __init__(self, client: CustomTelegramClient):
         super().__init__()
         self._client: CustomTelegramClient = client
+        self._codec: JSONCodec = get_codec()
         self._next_revision_call: int = 0
-        self._revisions: typing.List[dict] = []
+        # Each revision maps owner to JSON-encoded values of its keys.
+        # Revisions are copied on write and share encoded data of unchanged
+        # owners, so a write of a single key encodes only its value
+        self._revisions: typing.List[typing.Dict[str, typing.Dict[str, bytes]]] = []
+        self._dirty_keys: typing.Dict[typing.Tuple[str, str], bytes] = {}
         self._assets: int = None
         self._me: User = None
         self._redis: redis.Redis = None
         self._saving_task: asyncio.Future = None
+        self._generation: int = 0
+        self._owner_revisions: typing.Dict[str, int] = collections.defaultdict(int)
+        self._db_file: Path = None
+        self._journal_file: Path = None
+        self._journal_seq: int = 0
+        self._journal_size: int = 0
+        self._base_size: int = 0
+        self._pending: typing.Dict[typing.Tuple[str, str], None] = {}
+        self._full_save: bool = False
+        self._flush_task: asyncio.Future = None
+        self._flush_lock: asyncio.Lock = asyncio.Lock()
+        # Shutdown flush can run while the executor is still writing
+        self._write_lock: threading.Lock = threading.Lock()
+        self._flush_event: asyncio.Event = asyncio.Event()
+        self._flush_stats: typing.Dict[str, typing.Union[int, float]] = {
+            "flushes": 0,
+            "compactions": 0,
+            "bytes_written": 0,
+            "last_latency": 0.0,
+            "total_latency": 0.0,
+        }
 
     def __repr__(self):
         return object.__repr__(self)
 
+    def __setitem__(self, key: str, value: dict):
+        self._generation += 1
+        super().__setitem__(key, value)
+
+    def __delitem__(self, key: str):
+        self._generation += 1
+        super().__delitem__(key)
+
+    def clear(self):
+        self._generation += 1
+        super().clear()
+
+    def update(self, *args, **kwargs):
+        self._generation += 1
+        super().update(*args, **kwargs)
+
+    def revision(self, owner: str) -> typing.Tuple[int, int]:
+        """
+        Get revision of owner's data. It changes every time the owner
+        is written to or the database is saved after in-place modification,
+        so it can be used to invalidate derived caches
+        """
+        return self._generation, self._owner_revisions[owner]
+
     def _redis_save_sync(self):
         with self._redis.pipeline() as pipe:
             pipe.set(
                 str(self._client.tg_id),
-                json.dumps(self, ensure_ascii=True),
+                self._codec.dumps(self),
             )
             pipe.execute()
 
     async def remote_force_save(self) -> bool:
-        """Force save database to remote endpoint without waiting"""
+        """Force save database to remote endpoint or local file without waiting"""
         if not self._redis:
-            return False
+            return await self._flush()
 
         await utils.run_sync(self._redis_save_sync)
         logger.debug("Published db to Redis")
@@ -109,7 +308,14 @@ class Database(dict):
             await self.redis_init()
 
         self._db_file = main.BASE_PATH / f"config-{self._client.tg_id}.json"
+        self._journal_file = main.BASE_PATH / f"config-{self._client.tg_id}.journal"
         self.read()
+        # Full check is done only once on startup, further writes
+        # are checked incrementally against this revision
+        self.process_db_autofix(self)
+        self._make_revision(full=True)
+        # Changes, which are still waiting for the write-behind delay
+        on_shutdown(self._flush_sync)
 
         try:
             self._assets, _ = await utils.asset_channel(
@@ -134,10 +340,10 @@ class Database(dict):
         if self._redis:
             try:
                 self.update(
-                    **json.loads(
+                    **self._codec.loads(
                         self._redis.get(
                             str(self._client.tg_id),
-                        ).decode(),
+                        ),
                     )
                 )
             except Exception:
@@ -145,17 +351,78 @@ class Database(dict):
             return
 
         try:
-            self.update(**json.loads(self._db_file.read_text()))
+            data = self._db_file.read_bytes()
+            self._base_size = len(data)
+            self.update(**self._codec.loads(data))
         except json.decoder.JSONDecodeError:
             logger.warning("Database read failed! Creating new one...")
         except FileNotFoundError:
             logger.debug("Database file not found, creating new one...")
 
-    def process_db_autofix(self, db: dict) -> bool:
-        if not utils.is_serializable(db):
-            return False
+        self._journal_seq = dict.pop(self, JOURNAL_MARKER, {}).get("seq", 0)
+        self._replay_journal()
+
+    def _replay_journal(self):
+        """Apply journal records, which are newer than the main database file"""
+        try:
+            data = self._journal_file.read_bytes()
+        except FileNotFoundError:
+            return
+
+        self._journal_size = len(data)
+        base_seq = self._journal_seq
+        applied = 0
+
+        for line in data.splitlines():
+            try:
+                record = self._codec.loads(line)
+            except json.decoder.JSONDecodeError:
+                # Most likely the last record was torn by crash
+                logger.warning("Skipping broken database journal record")
+                continue
+
+            self._journal_seq = max(self._journal_seq, record["s"])
+            if record["s"] <= base_seq:
+                continue
+
+            # Keys are stringified the same way as in the main file
+            dict.setdefault(self, str(record["o"]), {})[str(record["k"])] = record["v"]
+            applied += 1
+
+        logger.debug("Applied %s database journal records", applied)
+
+    def process_db_autofix(
+        self,
+        db: dict,
+        owners: typing.Optional[typing.Iterable[str]] = None,
+        encoded: typing.Optional[typing.Dict[str, typing.Dict[str, bytes]]] = None,
+    ) -> bool:
+        """
+        Check database and drop malformed keys from it
+        :param db: Database to check
+        :param owners: If passed, only these owners will be checked,
+            otherwise the whole database is checked
+        :param encoded: Already encoded data of `owners`, which proves that
+            they are serializable. Encoded data of fixed owners is dropped from it
+        :return: Whether the database is serializable
+        """
+        if owners is None:
+            if not utils.is_serializable(db):
+                return False
 
-        for key, value in db.copy().items():
+            owners = list(db)
+        else:
+            owners = [owner for owner in owners if owner in db]
+            if encoded is None and not all(
+                utils.is_serializable(db[owner]) for owner in owners
+            ):
+                return False
+
+        if encoded is None:
+            encoded = {}
+
+        for key in owners:
+            value = db[key]
             if not isinstance(key, (str, int)):
                 logger.warning(
                     "DbAutoFix: Dropped key %s, because it is not string or int",
@@ -167,6 +434,7 @@ class Database(dict):
                 # If value is not a dict (module values), drop it,
                 # otherwise it may cause problems
                 del db[key]
+                encoded.pop(key, None)
                 logger.warning(
                     "DbAutoFix: Dropped key %s, because it is non-dict, but %s",
                     key,
@@ -174,9 +442,10 @@ class Database(dict):
                 )
                 continue
 
-            for subkey in value:
+            for subkey in list(value):
                 if not isinstance(subkey, (str, int)):
                     del db[key][subkey]
+                    encoded.pop(key, None)
                     logger.warning(
                         (
                             "DbAutoFix: Dropped subkey %s of db key %s, because it is"
@@ -190,13 +459,117 @@ class Database(dict):
         return True
 
     def save(self) -> bool:
-        """Save database"""
-        if not self.process_db_autofix(self):
-            try:
-                rev = self._revisions.pop()
-                while not self.process_db_autofix(rev):
-                    rev = self._revisions.pop()
-            except IndexError:
+        """
+        Save database.
+        Call it only after modifying the database in place,
+        otherwise use `set`, which saves only the changed key
+        """
+        # Any owner could have been modified in place, so derived caches
+        # of all owners are invalidated
+        self._generation += 1
+        self._full_save = True
+        return self._save(full=True)
+
+    def verify(self) -> bool:
+        """
+        Check the whole database and save it.
+        Usual saves check only owners, changed since the previous one
+        """
+        return self.save()
+
+    def _encode_owner(self, owner: str) -> typing.Dict[str, bytes]:
+        """
+        Encode values of owner's keys
+        :param owner: Owner to encode
+        :return: Encoded values by key
+        """
+        return {key: self._codec.dumps(value) for key, value in self[owner].items()}
+
+    def _encode_all(self) -> typing.Optional[typing.Dict[str, typing.Dict[str, bytes]]]:
+        """
+        Encode the whole database once for both validation and revision
+        :return: Encoded values by owner and key or `None`
+            if some value is not serializable
+        """
+        try:
+            return {
+                owner: self._encode_owner(owner)
+                for owner in self
+                # Non-dict owners are dropped by autofix
+                if isinstance(self[owner], dict)
+            }
+        except Exception:
+            return None
+
+    def _make_revision(
+        self,
+        full: bool,
+        encoded: typing.Optional[typing.Dict[str, typing.Dict[str, bytes]]] = None,
+    ):
+        """
+        Record current state of the database. Unchanged owners
+        share their encoded data with the previous revision
+        :param full: Whether the database was modified in place, so every owner
+            must be checked for changes. Otherwise only keys, written
+            with `set` since the previous revision, are recorded
+        :param encoded: Already encoded data of owners, which is reused
+            instead of encoding them again
+        """
+        last = self._revisions[-1] if self._revisions else {}
+        dirty_keys, self._dirty_keys = self._dirty_keys, {}
+
+        if full or not self._revisions:
+            encoded = encoded or {}
+            revision = {}
+            for owner in self:
+                data = encoded.get(owner)
+                if data is None:
+                    data = self._encode_owner(owner)
+
+                revision[owner] = last[owner] if last.get(owner) == data else data
+
+            if revision == last:
+                return
+        else:
+            revision = None
+            for (owner, key), data in dirty_keys.items():
+                if owner not in self or key not in self[owner]:
+                    # Key was deleted in place, which is recorded by `save`
+                    continue
+
+                if owner in last and last[owner].get(key) == data:
+                    continue
+
+                if revision is None:
+                    revision = dict(last)
+
+                if revision.get(owner) is last.get(owner):
+                    revision[owner] = dict(last.get(owner, {}))
+
+                revision[owner][key] = data
+
+            if revision is None:
+                return
+
+        if self._next_revision_call < time.time() or not self._revisions:
+            self._revisions += [revision]
+            self._next_revision_call = time.time() + 3
+        else:
+            # Keep the last revision up to date with the latest valid state
+            self._revisions[-1] = revision
+
+        del self._revisions[:-15]
+
+    def _save(self, full: bool = False) -> bool:
+        # Usual writes are validated by encoding of the written value in `set`.
+        # Full saves encode the whole database once: successful encoding
+        # proves it's serializable, and the same data is recorded in the revision
+        encoded = None
+        if (full or not self._revisions) and (
+            (encoded := self._encode_all()) is None
+            or not self.process_db_autofix(self, None, encoded)
+        ):
+            if not self._revisions:
                 raise RuntimeError(
                     "Can't find revision to restore broken database from "
                     "database is most likely broken and will lead to problems, "
@@ -204,31 +577,183 @@ class Database(dict):
                 )
 
             self.clear()
-            self.update(**rev)
+            self.update(
+                **{
+                    owner: {
+                        key: self._codec.loads(value) for key, value in data.items()
+                    }
+                    for owner, data in self._revisions[-1].items()
+                }
+            )
+            self._dirty_keys = {}
+            self._full_save = True
 
             raise RuntimeError(
                 "Rewriting database to the last revision because new one destructed it"
             )
 
-        if self._next_revision_call < time.time():
-            self._revisions += [dict(self)]
-            self._next_revision_call = time.time() + 3
-
-        while len(self._revisions) > 15:
-            self._revisions.pop()
+        self._make_revision(full, encoded)
 
         if self._redis:
+            self._pending = {}
+            self._full_save = False
             if not self._saving_task:
                 self._saving_task = asyncio.ensure_future(self._redis_save())
             return True
 
+        # In-place modifications can't be journaled, so they are written
+        # right away instead of waiting for the save delay
+        if full or len(self._pending) >= self.get(
+            main.__name__,
+            "db_save_max_pending",
+            SAVE_MAX_PENDING,
+        ):
+            self._flush_event.set()
+
+        if not self._flush_task or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._write_behind())
+
+        return True
+
+    @property
+    def flush_stats(self) -> typing.Dict[str, typing.Union[int, float]]:
+        """Statistics of database writes to disk. Latencies are in seconds"""
+        return {**self._flush_stats, "pending": len(self._pending)}
+
+    def _dump_journal(self) -> bytes:
+        records = []
+        for owner, key in self._pending:
+            if key not in dict.get(self, owner, {}):
+                continue
+
+            self._journal_seq += 1
+            records += [
+                self._codec.dumps(
+                    {
+                        "s": self._journal_seq,
+                        "o": owner,
+                        "k": key,
+                        "v": self[owner][key],
+                    }
+                )
+            ]
+
+        self._pending = {}
+        return b"".join(record + b"\n" for record in records)
+
+    def _dump_base(self) -> bytes:
+        self._pending = {}
+        self._full_save = False
+        # Main file is kept human-readable, because it's sometimes edited by hand
+        return self._codec.dumps(
+            {**self, JOURNAL_MARKER: {"seq": self._journal_seq}},
+            pretty=True,
+        )
+
+    def _append_journal_sync(self, data: bytes):
+        with open(self._journal_file, "ab") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _write_base_sync(self, data: bytes):
+        tmp = self._db_file.with_name(f"{self._db_file.name}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+        os.replace(tmp, self._db_file)
+        # Journal records are already included in the main file, and their
+        # sequence numbers are saved there, so truncating the journal is safe
+        # even if it's interrupted
+        with open(self._journal_file, "wb"):
+            pass
+
+    def _dump(self) -> typing.Tuple[bool, bytes]:
+        if self._full_save or self._journal_size > max(
+            JOURNAL_COMPACT_SIZE,
+            self._base_size,
+        ):
+            return True, self._dump_base()
+
+        return False, self._dump_journal()
+
+    def _write_sync(self, compact: bool, data: bytes):
+        with self._write_lock:
+            if compact:
+                self._write_base_sync(data)
+            else:
+                self._append_journal_sync(data)
+
+    def _written(self, compact: bool, data: bytes, latency: float):
+        if compact:
+            self._base_size = len(data)
+            self._journal_size = 0
+            self._flush_stats["compactions"] += 1
+        else:
+            self._journal_size += len(data)
+
+        self._flush_stats["flushes"] += 1
+        self._flush_stats["bytes_written"] += len(data)
+        self._flush_stats["last_latency"] = latency
+        self._flush_stats["total_latency"] += latency
+        logger.debug(
+            "Wrote %s bytes of database%s in %.3fs",
+            len(data),
+            " (compacted)" if compact else "",
+            latency,
+        )
+
+    async def _flush(self) -> bool:
+        """
+        Write pending changes to disk off the event loop.
+        Data is serialized on the event loop, so it can't be changed mid-write
+        """
+        async with self._flush_lock:
+            while self._pending or self._full_save:
+                start = time.perf_counter()
+                try:
+                    compact, data = self._dump()
+                    await utils.run_sync(self._write_sync, compact, data)
+                except Exception:
+                    logger.exception("Database save failed!")
+                    # Write everything on next save, because some changes
+                    # might have been lost
+                    self._full_save = True
+                    return False
+
+                self._written(compact, data, time.perf_counter() - start)
+
+        return True
+
+    async def _write_behind(self):
+        """Coalesce changes, made during the save delay, into a single write"""
+        while self._pending or self._full_save:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(
+                    self._flush_event.wait(),
+                    self.get(main.__name__, "db_save_delay", SAVE_DELAY),
+                )
+
+            self._flush_event.clear()
+            if not await self._flush():
+                return
+
+    def _flush_sync(self):
+        """Write pending changes on shutdown, when event loop is not available"""
+        if not self._pending and not self._full_save:
+            return
+
+        start = time.perf_counter()
         try:
-            self._db_file.write_text(json.dumps(self, indent=4))
+            compact, data = self._dump()
+            self._write_sync(compact, data)
         except Exception:
             logger.exception("Database save failed!")
-            return False
+            return
 
-        return True
+        self._written(compact, data, time.perf_counter() - start)
 
     async def store_asset(self, message: Message) -> int:
         """
@@ -289,7 +814,21 @@ class Database(dict):
                 "JSON-serializable key which will cause errors"
             )
 
-        if not utils.is_serializable(value):
+        if not isinstance(owner, (str, int)) or not isinstance(key, (str, int)):
+            raise RuntimeError(
+                "Attempted to write object to "
+                f"{owner=} {key=} of database. Only string and int "
+                "keys are allowed"
+            )
+
+        # Only the written value is checked and encoded, so the write doesn't
+        # depend on the size of the owner. The same data is recorded in the revision
+        try:
+            encoded = self._codec.dumps(value) if utils.is_serializable(value) else None
+        except Exception:
+            encoded = None
+
+        if encoded is None:
             raise RuntimeError(
                 "Attempted to write object of "
                 f"{key=} ({type(value)=}) to database. It is not "
@@ -297,7 +836,10 @@ class Database(dict):
             )
 
         super().setdefault(owner, {})[key] = value
-        return self.save()
+        self._owner_revisions[owner] += 1
+        self._pending[(owner, key)] = None
+        self._dirty_keys[(owner, key)] = encoded
+        return self._save()
 
     def pointer(
         self,
@@ -25,11 +25,10 @@
 import asyncio
 import collections
 import contextlib
-import copy
-import inspect
 import logging
 import re
 import sys
+import time
 import traceback
 import typing
 
@@ -38,15 +37,25 @@ from hikkatl.errors import FloodWaitError, RPCError
 from hikkatl.tl.types import Message
 
 from . import main, security, utils
+from ._context import enter_client, enter_module, enter_request, get_module
 from .database import Database
 from .loader import Modules
-from .tl_cache import CustomTelegramClient
+from .tl_cache import EDIT_LOG_TTL, CustomTelegramClient
+from .types import ParsedCommand, RateLimiter
 
 logger = logging.getLogger(__name__)
 
 # Keys for layout switch
 ru_keys = 'ёйцукенгшщзхъфывапролджэячсмитьбю.Ё"№;%:?ЙЦУКЕНГШЩЗХЪФЫВАПРОЛДЖЭ/ЯЧСМИТЬБЮ,'
 en_keys = "`qwertyuiop[]asdfghjkl;'zxcvbnm,./~@#$%^&QWERTYUIOP{}ASDFGHJKL:\"|ZXCVBNM<>?"
+layout_change = str.maketrans(ru_keys + en_keys, en_keys + ru_keys)
+
+# Default command costs and refill rate (tokens per second) of ratelimiter.
+# Command, marked with `@loader.ratelimit`, is more expensive. Custom cost
+# can be set via `ratelimit_cost` tag
+RATELIMIT_COST = 2
+RATELIMIT_STRICT_COST = 5
+RATELIMIT_RATE = 0.5
 ALL_TAGS = [
     "no_commands",
     "only_commands",
@@ -93,11 +102,353 @@ ALL_TAGS = [
 ]
 
 
-def _decrement_ratelimit(delay, data, key, severity):
-    def inner():
-        data[key] = max(0, data[key] - severity)
+# Tags, which depend only on the message itself. They are evaluated once per
+# update and the result is used to select watchers from the index
+STATIC_TAGS = {
+    "out": lambda m, _: getattr(m, "out", True),
+    "in": lambda m, _: not getattr(m, "out", True),
+    "only_messages": lambda m, _: isinstance(m, Message),
+    "editable": (
+        lambda m, _: not getattr(m, "out", False)
+        and not getattr(m, "fwd_from", False)
+        and not getattr(m, "sticker", False)
+        and not getattr(m, "via_bot_id", False)
+    ),
+    "no_media": lambda m, _: (
+        not isinstance(m, Message) or not getattr(m, "media", False)
+    ),
+    "only_media": lambda m, _: isinstance(m, Message) and getattr(m, "media", False),
+    "only_photos": lambda _, mime: mime.startswith("image/"),
+    "only_videos": lambda _, mime: mime.startswith("video/"),
+    "only_audios": lambda _, mime: mime.startswith("audio/"),
+    "only_stickers": lambda m, _: getattr(m, "sticker", False),
+    "only_docs": lambda m, _: getattr(m, "document", False),
+    "only_inline": lambda m, _: getattr(m, "via_bot_id", False),
+    "only_channels": lambda m, _: (
+        getattr(m, "is_channel", False) and not getattr(m, "is_group", False)
+    ),
+    "no_channels": lambda m, _: not getattr(m, "is_channel", False),
+    "no_groups": (
+        lambda m, _: not getattr(m, "is_group", False)
+        or getattr(m, "private", False)
+        or getattr(m, "is_channel", False)
+    ),
+    "only_groups": (
+        lambda m, _: getattr(m, "is_group", False)
+        or not getattr(m, "private", False)
+        and not getattr(m, "is_channel", False)
+    ),
+    "no_pm": lambda m, _: not getattr(m, "private", False),
+    "only_pm": lambda m, _: getattr(m, "private", False),
+    "no_inline": lambda m, _: not getattr(m, "via_bot_id", False),
+    "no_stickers": lambda m, _: not getattr(m, "sticker", False),
+    "no_docs": lambda m, _: not getattr(m, "document", False),
+    "no_audios": lambda _, mime: not mime.startswith("audio/"),
+    "no_videos": lambda _, mime: not mime.startswith("video/"),
+    "no_photos": lambda _, mime: not mime.startswith("image/"),
+    "no_forwards": lambda m, _: not getattr(m, "fwd_from", False),
+    "no_reply": lambda m, _: not getattr(m, "reply_to_msg_id", False),
+    "only_forwards": lambda m, _: getattr(m, "fwd_from", False),
+    "only_reply": lambda m, _: getattr(m, "reply_to_msg_id", False),
+    "mention": lambda m, _: getattr(m, "mentioned", False),
+    "no_mention": lambda m, _: not getattr(m, "mentioned", False),
+}
+
+STATIC_TAGS_POSITIONS = {tag: i for i, tag in enumerate(STATIC_TAGS)}
+
+
+def get_static_tags(m: typing.Any) -> typing.Tuple[bool, ...]:
+    """
+    Evaluates all static tags against the message in one pass
+    :param m: Message or event to evaluate tags against
+    :return: Tuple of results in the order of `STATIC_TAGS`
+    """
+    mime = utils.mime_type(m)
+    return tuple(bool(check(m, mime)) for check in STATIC_TAGS.values())
+
+
+def _normalize_chat_id(chat_id: typing.Union[int, str]) -> int:
+    return chat_id if not str(chat_id).startswith("-100") else int(str(chat_id)[4:])
+
+
+def _compile_regex(pattern: typing.Union[str, re.Pattern]) -> callable:
+    try:
+        pattern = re.compile(pattern)
+    except (re.error, TypeError):
+        logger.error("Invalid regex tag %s, handler will never match", pattern)
+        return lambda _: False
+
+    return lambda m: isinstance(m, Message) and pattern.search(m.raw_text)
+
+
+# Tags, which depend on the value passed to the tag. Each factory receives
+# the value once and returns the check for a message
+DYNAMIC_TAGS = {
+    "startswith": lambda value: (
+        lambda m: isinstance(m, Message) and m.raw_text.startswith(value)
+    ),
+    "endswith": lambda value: (
+        lambda m: isinstance(m, Message) and m.raw_text.endswith(value)
+    ),
+    "contains": lambda value: (
+        lambda m: isinstance(m, Message) and value in m.raw_text
+    ),
+    "filter": lambda value: lambda m: callable(value) and value(m),
+    "from_id": lambda value: lambda m: getattr(m, "sender_id", None) == value,
+    "chat_id": lambda value: (
+        lambda m, chat_id=_normalize_chat_id(value): utils.get_chat_id(m) == chat_id
+    ),
+    "regex": _compile_regex,
+}
+
+
+class TagsFilter:
+    """Tags of a single handler, compiled once into a list of checks"""
+
+    def __init__(self, func: callable):
+        self.no_commands = bool(getattr(func, "no_commands", False))
+        self.only_commands = bool(getattr(func, "only_commands", False))
+        self.static_positions = tuple(
+            STATIC_TAGS_POSITIONS[tag]
+            for tag in ALL_TAGS
+            if tag in STATIC_TAGS_POSITIONS and getattr(func, tag, False)
+        )
+
+        self._checks: typing.List[
+            typing.Tuple[str, typing.Optional[int], typing.Optional[callable]]
+        ] = []
+
+        for tag in ALL_TAGS:
+            if not getattr(func, tag, False):
+                continue
+
+            if tag in STATIC_TAGS_POSITIONS:
+                self._checks += [(tag, STATIC_TAGS_POSITIONS[tag], None)]
+            elif tag in DYNAMIC_TAGS:
+                self._checks += [(tag, None, DYNAMIC_TAGS[tag](getattr(func, tag)))]
+
+    def check(
+        self,
+        m: typing.Any,
+        static_tags: typing.Tuple[bool, ...],
+    ) -> typing.Optional[str]:
+        """
+        Check the message against compiled tags
+        :param m: Message or event
+        :param static_tags: Result of `get_static_tags` for the message
+        :return: The first failed tag or `None`
+        """
+        return next(
+            (
+                tag
+                for tag, position, check in self._checks
+                if not (static_tags[position] if check is None else check(m))
+            ),
+            None,
+        )
+
+
+class WatcherIndex:
+    """
+    Buckets watchers by their declared tags, so each update
+    touches only the watchers, which could match it
+    """
+
+    MAX_CACHED_SELECTIONS = 4096
+
+    def __init__(
+        self,
+        watchers: typing.List[callable],
+        get_tags_filter: typing.Callable[[callable], TagsFilter],
+    ):
+        self._positions: typing.Dict[callable, int] = {}
+        self._static: typing.Dict[callable, typing.Tuple[int, ...]] = {}
+        self._modnames: typing.Dict[callable, str] = {}
+        self._general: typing.List[callable] = []
+        self._by_chat = collections.defaultdict(list)
+        self._by_sender = collections.defaultdict(list)
+        self._by_first_char = collections.defaultdict(list)
+        self._selections: typing.Dict[tuple, typing.List[callable]] = {}
+
+        for position, func in enumerate(watchers):
+            self._positions.setdefault(func, position)
+            self._modnames[func] = str(func.__self__.__class__.strings["name"])
+            self._static[func] = get_tags_filter(func).static_positions
+            self._bucket(func).append(func)
+
+    def _bucket(self, func: callable) -> typing.List[callable]:
+        if getattr(func, "chat_id", False):
+            with contextlib.suppress(ValueError):
+                return self._by_chat[_normalize_chat_id(func.chat_id)]
+
+        if (from_id := getattr(func, "from_id", None)) and isinstance(from_id, int):
+            return self._by_sender[from_id]
+
+        if (startswith := getattr(func, "startswith", None)) and isinstance(
+            startswith,
+            str,
+        ):
+            return self._by_first_char[startswith[0]]
+
+        return self._general
+
+    def _select(
+        self,
+        key: tuple,
+        watchers: typing.List[callable],
+        static_tags: typing.Tuple[bool, ...],
+    ) -> typing.List[callable]:
+        if (selection := self._selections.get((key, static_tags))) is None:
+            if len(self._selections) >= self.MAX_CACHED_SELECTIONS:
+                self._selections.clear()
+
+            selection = self._selections[(key, static_tags)] = [
+                func
+                for func in watchers
+                if all(static_tags[i] for i in self._static[func])
+            ]
+
+        return selection
+
+    def modname(self, func: callable) -> str:
+        return self._modnames[func]
+
+    def candidates(
+        self,
+        m: typing.Any,
+        chat_id: int,
+        static_tags: typing.Tuple[bool, ...],
+    ) -> typing.List[callable]:
+        """
+        Get watchers, which can match the message
+        :param m: Message or event
+        :param chat_id: Chat ID of the message
+        :param static_tags: Result of `get_static_tags` for the message
+        :return: Watchers in the order of their registration
+        """
+        selections = [self._select(("*",), self._general, static_tags)]
+
+        if chat_id in self._by_chat:
+            selections += [
+                self._select(("chat", chat_id), self._by_chat[chat_id], static_tags)
+            ]
+
+        sender_id = getattr(m, "sender_id", None)
+        if sender_id in self._by_sender:
+            selections += [
+                self._select(
+                    ("sender", sender_id),
+                    self._by_sender[sender_id],
+                    static_tags,
+                )
+            ]
 
-    asyncio.get_event_loop().call_later(delay, inner)
+        if (
+            self._by_first_char
+            and isinstance(m, Message)
+            and (first_char := (m.raw_text or "")[:1]) in self._by_first_char
+        ):
+            selections += [
+                self._select(
+                    ("text", first_char),
+                    self._by_first_char[first_char],
+                    static_tags,
+                )
+            ]
+
+        if len(selections) == 1:
+            return selections[0]
+
+        return sorted(
+            (func for selection in selections for func in selection),
+            key=self._positions.__getitem__,
+        )
+
+
+class EventContext:
+    """
+    State of a single update, which is computed at most once
+    and shared between all handlers, matched against it
+    """
+
+    def __init__(
+        self,
+        event: typing.Union[events.NewMessage, events.MessageDeleted],
+        parse_command: typing.Callable[..., typing.Awaitable[typing.Any]],
+    ):
+        self.event = event
+        self.message = (
+            event if isinstance(event, Message) else getattr(event, "message", event)
+        )
+        self._parse_command = parse_command
+        self._static_tags: typing.Optional[typing.Tuple[bool, ...]] = None
+        self._command: typing.Optional[asyncio.Future] = None
+
+    @property
+    def static_tags(self) -> typing.Tuple[bool, ...]:
+        if self._static_tags is None:
+            self._static_tags = get_static_tags(self.message)
+
+        return self._static_tags
+
+    async def get_command(
+        self,
+    ) -> typing.Union[bool, typing.Tuple[Message, str, str, callable]]:
+        """
+        Parse the update as a command once. All `only_commands` and
+        `no_commands` handlers share the same result
+        """
+        if self._command is None:
+            self._command = asyncio.ensure_future(
+                self._parse_command(self.event, watcher=True)
+            )
+
+        return await self._command
+
+
+class RoutingSnapshot(typing.NamedTuple):
+    """Compiled dispatching settings, rebuilt only when they change in database"""
+
+    prefix: str
+    translated_prefix: str
+    blacklist_chats: typing.FrozenSet[typing.Union[int, str]]
+    whitelist_chats: typing.FrozenSet[int]
+    whitelist_modules: typing.FrozenSet[str]
+    no_nickname: bool
+    nonickcmds: typing.FrozenSet[str]
+    nonickusers: typing.FrozenSet[int]
+    nonickchats: typing.FrozenSet[int]
+    grep: bool
+    edit_log_ttl: int
+    disabled_watchers: typing.Dict[str, typing.FrozenSet[typing.Union[int, str]]]
+
+    def is_chat_blocked(self, chat_id: int) -> bool:
+        return chat_id in self.blacklist_chats or (
+            self.whitelist_chats and chat_id not in self.whitelist_chats
+        )
+
+    def is_module_blocked(self, chat_id: int, module: str) -> bool:
+        return f"{chat_id}.{module}" in self.blacklist_chats or (
+            self.whitelist_modules
+            and f"{chat_id}.{module}" not in self.whitelist_modules
+        )
+
+    def is_watcher_disabled(self, modname: str, message: Message, chat_id: int) -> bool:
+        if (rules := self.disabled_watchers.get(modname)) is None:
+            return False
+
+        return isinstance(message, Message) and (
+            "*" in rules
+            or chat_id in rules
+            or "only_chats" in rules
+            and message.is_private
+            or "only_pm" in rules
+            and not message.is_private
+            or "out" in rules
+            and not message.out
+            or "in" in rules
+            and message.out
+        )
 
 
 class CommandDispatcher:
@@ -112,10 +463,16 @@ class CommandDispatcher:
         self.client = client
         self._db = db
 
-        self._ratelimit_storage_user = collections.defaultdict(int)
-        self._ratelimit_storage_chat = collections.defaultdict(int)
         self._ratelimit_max_user = db.get(__name__, "ratelimit_max_user", 30)
         self._ratelimit_max_chat = db.get(__name__, "ratelimit_max_chat", 100)
+        self._ratelimit_user = RateLimiter(
+            self._ratelimit_max_user,
+            db.get(__name__, "ratelimit_rate", RATELIMIT_RATE),
+        )
+        self._ratelimit_chat = RateLimiter(
+            self._ratelimit_max_chat,
+            db.get(__name__, "ratelimit_rate", RATELIMIT_RATE),
+        )
 
         self.security = security.SecurityManager(client, db)
 
@@ -135,52 +492,149 @@ class CommandDispatcher:
 
         self.raw_handlers = []
 
+        self._routing: typing.Optional[RoutingSnapshot] = None
+        self._routing_revision: typing.Optional[typing.Tuple[int, int]] = None
+        self._watcher_index: typing.Optional[WatcherIndex] = None
+        self._watcher_index_revision: typing.Optional[int] = None
+        self._tags_filters: typing.Dict[callable, TagsFilter] = {}
+        self._tags_filters_revision: typing.Optional[int] = None
+
+    def _build_routing(self) -> RoutingSnapshot:
+        prefix = self._db.get(main.__name__, "command_prefix", False) or "."
+        return RoutingSnapshot(
+            prefix=prefix,
+            translated_prefix=str.translate(prefix, layout_change),
+            blacklist_chats=frozenset(
+                self._db.get(main.__name__, "blacklist_chats", [])
+            ),
+            whitelist_chats=frozenset(
+                self._db.get(main.__name__, "whitelist_chats", [])
+            ),
+            whitelist_modules=frozenset(
+                self._db.get(main.__name__, "whitelist_modules", [])
+            ),
+            no_nickname=self._db.get(main.__name__, "no_nickname", False),
+            nonickcmds=frozenset(self._db.get(main.__name__, "nonickcmds", [])),
+            nonickusers=frozenset(self._db.get(main.__name__, "nonickusers", [])),
+            nonickchats=frozenset(self._db.get(main.__name__, "nonickchats", [])),
+            grep=self._db.get(main.__name__, "grep", False),
+            edit_log_ttl=self._db.get(main.__name__, "edit_log_ttl", EDIT_LOG_TTL),
+            disabled_watchers={
+                modname: frozenset(rules)
+                for modname, rules in self._db.get(
+                    main.__name__,
+                    "disabled_watchers",
+                    {},
+                ).items()
+            },
+        )
+
+    @property
+    def routing(self) -> RoutingSnapshot:
+        """
+        Dispatching settings snapshot. Rebuilt only when `hikka.main` database
+        keys are changed, so each update costs several set lookups
+        """
+        revision = self._db.revision(main.__name__)
+        if revision != self._routing_revision:
+            self._routing = self._build_routing()
+            self._routing_revision = revision
+            logger.debug("Rebuilt routing snapshot for revision %s", revision)
+
+        return self._routing
+
+    @property
+    def watcher_index(self) -> WatcherIndex:
+        """Watcher index, rebuilt only when watchers are changed in loader"""
+        if self._modules.revision != self._watcher_index_revision:
+            self._watcher_index = WatcherIndex(
+                self._modules.watchers,
+                self.get_tags_filter,
+            )
+            self._watcher_index_revision = self._modules.revision
+            logger.debug(
+                "Rebuilt watcher index of %s watchers", len(self._modules.watchers)
+            )
+
+        return self._watcher_index
+
+    def get_tags_filter(self, func: callable) -> TagsFilter:
+        """Get compiled tags of the handler. Compiled once per module load"""
+        if self._modules.revision != self._tags_filters_revision:
+            self._tags_filters = {}
+            self._tags_filters_revision = self._modules.revision
+
+        if (tags_filter := self._tags_filters.get(func)) is None:
+            tags_filter = self._tags_filters[func] = TagsFilter(func)
+
+        return tags_filter
+
+    @property
+    def ratelimit_stats(self) -> typing.Dict[str, typing.Dict[str, int]]:
+        """Counters of allowed and throttled command calls"""
+        return {
+            "user": self._ratelimit_user.stats,
+            "chat": self._ratelimit_chat.stats,
+        }
+
     async def _handle_ratelimit(self, message: Message, func: callable) -> bool:
         if await self.security.check(message, security.OWNER):
             return True
 
         func = getattr(func, "__func__", func)
-        ret = True
-        chat = self._ratelimit_storage_chat[message.chat_id]
+        cost = getattr(
+            func,
+            "ratelimit_cost",
+            (
+                RATELIMIT_STRICT_COST
+                if getattr(func, "ratelimit", False)
+                else RATELIMIT_COST
+            ),
+        )
+        now = time.monotonic()
 
-        if message.sender_id:
-            user = self._ratelimit_storage_user[message.sender_id]
-            severity = (5 if getattr(func, "ratelimit", False) else 2) * (
-                (user + chat) // 30 + 1
-            )
-            user += severity
-            self._ratelimit_storage_user[message.sender_id] = user
-            if user > self._ratelimit_max_user:
-                ret = False
-            else:
-                self._ratelimit_storage_chat[message.chat_id] = chat
+        if message.sender_id and not self._ratelimit_user.can_consume(
+            message.sender_id,
+            cost,
+            now,
+        ):
+            self._ratelimit_user.reject()
+            return False
 
-            _decrement_ratelimit(
-                self._ratelimit_max_user * severity,
-                self._ratelimit_storage_user,
-                message.sender_id,
-                severity,
-            )
-        else:
-            severity = (5 if getattr(func, "ratelimit", False) else 2) * (
-                chat // 15 + 1
-            )
+        if not self._ratelimit_chat.consume(message.chat_id, cost, now):
+            return False
 
-        chat += severity
+        if message.sender_id:
+            self._ratelimit_user.consume(message.sender_id, cost, now)
 
-        if chat > self._ratelimit_max_chat:
-            ret = False
+        return True
 
-        _decrement_ratelimit(
-            self._ratelimit_max_chat * severity,
-            self._ratelimit_storage_chat,
-            message.chat_id,
-            severity,
-        )
+    def _parse_command(self, message: Message, prefix: str) -> ParsedCommand:
+        """
+        Parse the command once per text of message. The result is attached
+        to the message, so it's shared between handlers and reused by
+        security and `utils.get_args*`
+        :param message: Message, starting with prefix
+        :param prefix: Command prefix
+        :return: Parsed command
+        """
+        if (
+            parsed := getattr(message, "hikka_command", None)
+        ) is None or not parsed.is_valid_for(message):
+            parsed = message.hikka_command = ParsedCommand.parse(
+                message.message,
+                prefix,
+                self._modules.dispatch,
+            )
 
-        return ret
+        return parsed
 
     def _handle_grep(self, message: Message) -> Message:
+        if (
+            parsed := getattr(message, "hikka_command", None)
+        ) is not None and "grep" not in parsed.args:
+            return message
+
         # Allow escaping grep with double stick
         if "||grep" in message.text or "|| grep" in message.text:
             message.raw_text = re.sub(r"\|\| ?grep", "| grep", message.raw_text)
@@ -273,9 +727,10 @@ class CommandDispatcher:
         if not hasattr(event, "message") or not hasattr(event.message, "message"):
             return False
 
-        prefix = self._db.get(main.__name__, "command_prefix", False) or "."
-        change = str.maketrans(ru_keys + en_keys, en_keys + ru_keys)
-        message = utils.censor(event.message)
+        routing = self.routing
+        prefix = routing.prefix
+        translated_prefix = routing.translated_prefix
+        message = utils.censor_phones(event.message)
 
         if not event.message.message:
             return False
@@ -286,8 +741,8 @@ class CommandDispatcher:
             and (
                 message.message.startswith(prefix * 2)
                 and any(s != prefix for s in message.message)
-                or message.message.startswith(str.translate(prefix * 2, change))
-                and any(s != str.translate(prefix, change) for s in message.message)
+                or message.message.startswith(translated_prefix * 2)
+                and any(s != translated_prefix for s in message.message)
             )
         ):
             # Allow escaping commands using .'s
@@ -303,11 +758,11 @@ class CommandDispatcher:
             return False
 
         if (
-            event.message.message.startswith(str.translate(prefix, change))
-            and str.translate(prefix, change) != prefix
+            event.message.message.startswith(translated_prefix)
+            and translated_prefix != prefix
         ):
-            message.message = str.translate(message.message, change)
-            message.text = str.translate(message.text, change)
+            message.message = str.translate(message.message, layout_change)
+            message.text = str.translate(message.text, layout_change)
         elif not event.message.message.startswith(prefix):
             return False
 
@@ -320,13 +775,9 @@ class CommandDispatcher:
         ):
             return False
 
-        blacklist_chats = self._db.get(main.__name__, "blacklist_chats", [])
-        whitelist_chats = self._db.get(main.__name__, "whitelist_chats", [])
-        whitelist_modules = self._db.get(main.__name__, "whitelist_modules", [])
+        chat_id = utils.get_chat_id(message)
 
-        if utils.get_chat_id(message) in blacklist_chats or (
-            whitelist_chats and utils.get_chat_id(message) not in whitelist_chats
-        ):
+        if routing.is_chat_blocked(chat_id):
             return False
 
         if not message.message or len(message.message) == 1:
@@ -334,14 +785,14 @@ class CommandDispatcher:
 
         initiator = getattr(event, "sender_id", 0)
 
-        command = message.message[1:].strip().split(maxsplit=1)[0]
-        tag = command.split("@", maxsplit=1)
+        parsed = self._parse_command(message, prefix)
+        command = parsed.command
 
-        if len(tag) == 2:
-            if tag[1] == "me":
+        if parsed.username is not None:
+            if parsed.username == "me":
                 if not message.out:
                     return False
-            elif tag[1].lower() not in self._cached_usernames:
+            elif parsed.username.lower() not in self._cached_usernames:
                 return False
         elif (
             event.out
@@ -356,16 +807,15 @@ class CommandDispatcher:
             pass
         elif (
             not event.is_private
-            and not self._db.get(main.__name__, "no_nickname", False)
-            and command not in self._db.get(main.__name__, "nonickcmds", [])
-            and initiator not in self._db.get(main.__name__, "nonickusers", [])
+            and not routing.no_nickname
+            and command not in routing.nonickcmds
+            and initiator not in routing.nonickusers
+            and chat_id not in routing.nonickchats
             and not self.security.check_tsec(initiator, command)
-            and utils.get_chat_id(event)
-            not in self._db.get(main.__name__, "nonickchats", [])
         ):
             return False
 
-        txt, func = self._modules.dispatch(tag[0])
+        txt, func = parsed.resolved, parsed.func
 
         if (
             not func
@@ -378,18 +828,21 @@ class CommandDispatcher:
         ):
             return False
 
-        if message.is_channel and message.edit_date and not message.is_group:
-            async for event in self._client.iter_admin_log(
-                utils.get_chat_id(message),
-                limit=10,
-                edit=True,
-            ):
-                if event.action.prev_message.id == message.id:
-                    if event.user_id != self._client.tg_id:
-                        logger.debug("Ignoring edit in channel")
-                        return False
-
-                    break
+        if (
+            message.is_channel
+            and message.edit_date
+            and not message.is_group
+            and (
+                editor := await self._client.get_edit_author_cached(
+                    message,
+                    routing.edit_log_ttl,
+                )
+            )
+            is not None
+            and editor != self._client.tg_id
+        ):
+            logger.debug("Ignoring edit in channel")
+            return False
 
         if (
             message.is_channel
@@ -402,32 +855,34 @@ class CommandDispatcher:
             return False
 
         message.message = prefix + txt + message.message[len(prefix + command) :]
+        # Command is resolved in text, so is the parse
+        message.hikka_command = parsed.resolve(message.message)
 
-        if (
-            f"{str(utils.get_chat_id(message))}.{func.__self__.__module__}"
-            in blacklist_chats
-            or whitelist_modules
-            and f"{utils.get_chat_id(message)}.{func.__self__.__module__}"
-            not in whitelist_modules
-        ):
+        if routing.is_module_blocked(chat_id, func.__self__.__module__):
             return False
 
         if await self._handle_tags(event, func):
             return False
 
-        if self._db.get(main.__name__, "grep", False) and not watcher:
+        if routing.grep and not watcher:
             message = self._handle_grep(message)
 
+            # Grep arguments are cut from the text
+            if not message.hikka_command.is_valid_for(message):
+                message.hikka_command = message.hikka_command.resolve(message.message)
+
         return message, prefix, txt, func
 
     async def handle_raw(self, event: events.Raw):
         """Handle raw events."""
-        for handler in self.raw_handlers:
-            if isinstance(event, tuple(handler.updates)):
-                try:
-                    await handler(event)
-                except Exception as e:
-                    logger.exception("Error in raw handler %s: %s", handler.id, e)
+        with enter_client(self.client):
+            for handler in self.raw_handlers:
+                if isinstance(event, tuple(handler.updates)):
+                    try:
+                        with enter_module(get_module(handler)):
+                            await handler(event)
+                    except Exception as e:
+                        logger.exception("Error in raw handler %s: %s", handler.id, e)
 
     async def handle_command(
         self,
@@ -451,7 +906,7 @@ class CommandDispatcher:
     async def command_exc(self, _, message: Message):
         """Handle command exceptions."""
         exc = sys.exc_info()[1]
-        logger.exception("Command failed", extra={"stack": inspect.stack()})
+        logger.exception("Command failed")
         if isinstance(exc, RPCError):
             if isinstance(exc, FloodWaitError):
                 hours = exc.seconds // 3600
@@ -505,7 +960,7 @@ class CommandDispatcher:
             await (message.edit if message.out else message.reply)(txt)
 
     async def watcher_exc(self, *_):
-        logger.exception("Error running watcher", extra={"stack": inspect.stack()})
+        logger.exception("Error running watcher")
 
     async def _handle_tags(
         self,
@@ -518,150 +973,59 @@ class CommandDispatcher:
         self,
         event: typing.Union[events.NewMessage, events.MessageDeleted],
         func: callable,
+        context: typing.Optional[EventContext] = None,
     ) -> str:
         """
         Handle tags.
         :param event: The event to handle.
         :param func: The function to handle.
+        :param context: State of the event, shared between handlers.
         :return: The reason for the tag to fail.
         """
-        m = event if isinstance(event, Message) else getattr(event, "message", event)
-
-        reverse_mapping = {
-            "out": lambda: getattr(m, "out", True),
-            "in": lambda: not getattr(m, "out", True),
-            "only_messages": lambda: isinstance(m, Message),
-            "editable": (
-                lambda: not getattr(m, "out", False)
-                and not getattr(m, "fwd_from", False)
-                and not getattr(m, "sticker", False)
-                and not getattr(m, "via_bot_id", False)
-            ),
-            "no_media": lambda: (
-                not isinstance(m, Message) or not getattr(m, "media", False)
-            ),
-            "only_media": lambda: isinstance(m, Message) and getattr(m, "media", False),
-            "only_photos": lambda: utils.mime_type(m).startswith("image/"),
-            "only_videos": lambda: utils.mime_type(m).startswith("video/"),
-            "only_audios": lambda: utils.mime_type(m).startswith("audio/"),
-            "only_stickers": lambda: getattr(m, "sticker", False),
-            "only_docs": lambda: getattr(m, "document", False),
-            "only_inline": lambda: getattr(m, "via_bot_id", False),
-            "only_channels": lambda: (
-                getattr(m, "is_channel", False) and not getattr(m, "is_group", False)
-            ),
-            "no_channels": lambda: not getattr(m, "is_channel", False),
-            "no_groups": (
-                lambda: not getattr(m, "is_group", False)
-                or getattr(m, "private", False)
-                or getattr(m, "is_channel", False)
-            ),
-            "only_groups": (
-                lambda: getattr(m, "is_group", False)
-                or not getattr(m, "private", False)
-                and not getattr(m, "is_channel", False)
-            ),
-            "no_pm": lambda: not getattr(m, "private", False),
-            "only_pm": lambda: getattr(m, "private", False),
-            "no_inline": lambda: not getattr(m, "via_bot_id", False),
-            "no_stickers": lambda: not getattr(m, "sticker", False),
-            "no_docs": lambda: not getattr(m, "document", False),
-            "no_audios": lambda: not utils.mime_type(m).startswith("audio/"),
-            "no_videos": lambda: not utils.mime_type(m).startswith("video/"),
-            "no_photos": lambda: not utils.mime_type(m).startswith("image/"),
-            "no_forwards": lambda: not getattr(m, "fwd_from", False),
-            "no_reply": lambda: not getattr(m, "reply_to_msg_id", False),
-            "only_forwards": lambda: getattr(m, "fwd_from", False),
-            "only_reply": lambda: getattr(m, "reply_to_msg_id", False),
-            "mention": lambda: getattr(m, "mentioned", False),
-            "no_mention": lambda: not getattr(m, "mentioned", False),
-            "startswith": lambda: (
-                isinstance(m, Message) and m.raw_text.startswith(func.startswith)
-            ),
-            "endswith": lambda: (
-                isinstance(m, Message) and m.raw_text.endswith(func.endswith)
-            ),
-            "contains": lambda: isinstance(m, Message) and func.contains in m.raw_text,
-            "filter": lambda: callable(func.filter) and func.filter(m),
-            "from_id": lambda: getattr(m, "sender_id", None) == func.from_id,
-            "chat_id": lambda: utils.get_chat_id(m) == (
-                func.chat_id
-                if not str(func.chat_id).startswith("-100")
-                else int(str(func.chat_id)[4:])
-            ),
-            "regex": lambda: (
-                isinstance(m, Message) and re.search(func.regex, m.raw_text)
-            ),
-        }
+        if context is None:
+            context = EventContext(event, self._handle_command)
 
-        return (
-            "no_commands"
-            if getattr(func, "no_commands", False)
-            and await self._handle_command(event, watcher=True)
-            else (
-                "only_commands"
-                if getattr(func, "only_commands", False)
-                and not await self._handle_command(event, watcher=True)
-                else next(
-                    (
-                        tag
-                        for tag in ALL_TAGS
-                        if getattr(func, tag, False)
-                        and tag in reverse_mapping
-                        and not reverse_mapping[tag]()
-                    ),
-                    None,
-                )
-            )
-        )
+        tags_filter = self.get_tags_filter(func)
+
+        if tags_filter.no_commands and await context.get_command():
+            return "no_commands"
+
+        if tags_filter.only_commands and not await context.get_command():
+            return "only_commands"
+
+        return tags_filter.check(context.message, context.static_tags)
 
     async def handle_incoming(
         self,
         event: typing.Union[events.NewMessage, events.MessageDeleted],
     ):
         """Handle all incoming messages"""
-        message = utils.censor(getattr(event, "message", event))
-
-        blacklist_chats = self._db.get(main.__name__, "blacklist_chats", [])
-        whitelist_chats = self._db.get(main.__name__, "whitelist_chats", [])
-        whitelist_modules = self._db.get(main.__name__, "whitelist_modules", [])
+        message = utils.censor_phones(getattr(event, "message", event))
+        routing = self.routing
+        chat_id = utils.get_chat_id(message)
 
-        if utils.get_chat_id(message) in blacklist_chats or (
-            whitelist_chats and utils.get_chat_id(message) not in whitelist_chats
-        ):
+        if routing.is_chat_blocked(chat_id):
             logger.debug("Message is blacklisted")
             return
 
-        for func in self._modules.watchers:
-            bl = self._db.get(main.__name__, "disabled_watchers", {})
-            modname = str(func.__self__.__class__.strings["name"])
-
-            if (
-                modname in bl
-                and isinstance(message, Message)
-                and (
-                    "*" in bl[modname]
-                    or utils.get_chat_id(message) in bl[modname]
-                    or "only_chats" in bl[modname]
-                    and message.is_private
-                    or "only_pm" in bl[modname]
-                    and not message.is_private
-                    or "out" in bl[modname]
-                    and not message.out
-                    or "in" in bl[modname]
-                    and message.out
-                )
-                or f"{str(utils.get_chat_id(message))}.{func.__self__.__module__}"
-                in blacklist_chats
-                or whitelist_modules
-                and f"{str(utils.get_chat_id(message))}.{func.__self__.__module__}"
-                not in whitelist_modules
-                or await self._handle_tags(event, func)
-            ):
+        index = self.watcher_index
+        context = EventContext(event, self._handle_command)
+
+        for func in index.candidates(message, chat_id, context.static_tags):
+            modname = index.modname(func)
+
+            if routing.is_watcher_disabled(modname, message, chat_id):
+                reason = "disabled_watchers"
+            elif routing.is_module_blocked(chat_id, func.__self__.__module__):
+                reason = "blacklist_chats"
+            else:
+                reason = await self._handle_tags_ext(event, func, context)
+
+            if reason:
                 logger.debug(
                     "Ignored watcher of module %s because of %s",
                     modname,
-                    await self._handle_tags_ext(event, func),
+                    reason,
                 )
                 continue
 
@@ -691,10 +1055,10 @@ class CommandDispatcher:
         exception_handler: callable,
         *args,
     ):
-        # Will be used to determine, which client caused logging messages
-        # parsed via inspect.stack()
-        _hikka_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
-        try:
-            await func(message)
-        except Exception as e:
-            await exception_handler(e, message, *args)
+        # Used by logging and error handling to determine the client,
+        # module and command, which caused the message
+        with enter_request(self.client, func, message):
+            try:
+                await func(message)
+            except Exception as e:
+                await exception_handler(e, message, *args)
@@ -23,6 +23,7 @@ from aiogram.types import (
 from aiogram.types import Message as AiogramMessage
 
 from .. import utils
+from .._context import enter_module, get_module
 from .types import BotInlineCall, InlineCall, InlineQuery, InlineUnit
 
 logger = logging.getLogger(__name__)
@@ -43,7 +44,8 @@ class Events(InlineUnit):
                 continue
 
             try:
-                await mod.aiogram_watcher(message)
+                with enter_module(mod):
+                    await mod.aiogram_watcher(message)
             except Exception:
                 logger.exception("Error on running aiogram watcher!")
 
@@ -64,9 +66,10 @@ class Events(InlineUnit):
             instance = InlineQuery(inline_query)
 
             try:
-                if not (
-                    result := await self._allmodules.inline_handlers[cmd](instance)
-                ):
+                with enter_module(get_module(self._allmodules.inline_handlers[cmd])):
+                    result = await self._allmodules.inline_handlers[cmd](instance)
+
+                if not result:
                     return
             except Exception:
                 logger.exception("Error on running inline watcher!")
@@ -225,13 +228,14 @@ class Events(InlineUnit):
         for func in self._allmodules.callback_handlers.values():
             if await self.check_inline_security(func=func, user=call.from_user.id):
                 try:
-                    await func(
-                        (
-                            BotInlineCall
-                            if getattr(getattr(call, "message", None), "chat", None)
-                            else InlineCall
-                        )(call, self, None)
-                    )
+                    with enter_module(get_module(func)):
+                        await func(
+                            (
+                                BotInlineCall
+                                if getattr(getattr(call, "message", None), "chat", None)
+                                else InlineCall
+                            )(call, self, None)
+                        )
                 except Exception:
                     logger.exception("Error on running callback watcher!")
                     await call.answer(
@@ -280,15 +284,18 @@ class Events(InlineUnit):
                         return
 
                     try:
-                        result = await button["callback"](
-                            (
-                                BotInlineCall
-                                if getattr(getattr(call, "message", None), "chat", None)
-                                else InlineCall
-                            )(call, self, unit_id),
-                            *button.get("args", []),
-                            **button.get("kwargs", {}),
-                        )
+                        with enter_module(get_module(button["callback"])):
+                            result = await button["callback"](
+                                (
+                                    BotInlineCall
+                                    if getattr(
+                                        getattr(call, "message", None), "chat", None
+                                    )
+                                    else InlineCall
+                                )(call, self, unit_id),
+                                *button.get("args", []),
+                                **button.get("kwargs", {}),
+                            )
                     except Exception:
                         logger.exception("Error on running callback watcher!")
                         await call.answer(
@@ -254,7 +254,7 @@ class Utils(InlineUnit):
             logger.debug("Found caller: %s", caller)
 
             return lambda: self._client.dispatcher.security.get_flags(
-                getattr(caller, "__self__", caller),
+                getattr(caller, "__func__", caller),
             )
         except Exception:
             logger.debug("Can't parse security mask in form", exc_info=True)
@@ -8,7 +8,6 @@
 
 import asyncio
 import contextlib
-import copy
 import importlib
 import importlib.machinery
 import importlib.util
@@ -26,6 +25,7 @@ from uuid import uuid4
 from hikkatl.tl.tlobject import TLObject
 
 from . import security, utils, validators
+from ._context import enter_module
 from .database import Database
 from .inline.core import InlineManager
 from .translations import Strings, Translator
@@ -158,11 +158,6 @@ class InfiniteLoop:
         self._wait_for_stop.set()
 
     def stop(self, *args, **kwargs):
-        with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(  # noqa: F841
-                self.module_instance.allmodules.client.tg_id
-            )
-
         if self._task:
             logger.debug("Stopped loop for method %s", self.func)
             self._wait_for_stop = asyncio.Event()
@@ -175,11 +170,6 @@ class InfiniteLoop:
         return asyncio.ensure_future(stop_placeholder())
 
     def start(self, *args, **kwargs):
-        with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(  # noqa: F841
-                self.module_instance.allmodules.client.tg_id
-            )
-
         if not self._task:
             logger.debug("Started loop for method %s", self.func)
             self._task = asyncio.ensure_future(self.actual_loop(*args, **kwargs))
@@ -208,7 +198,8 @@ class InfiniteLoop:
                 break
 
             try:
-                await self.func(self.module_instance, *args, **kwargs)
+                with enter_module(self.module_instance):
+                    await self.func(self.module_instance, *args, **kwargs)
             except StopLoop:
                 break
             except Exception:
@@ -322,7 +313,10 @@ tds = translatable_docstring  # Shorter name for modules to use
 
 
 def ratelimit(func: Command) -> Command:
-    """Decorator that causes ratelimiting for this command to be enforced more strictly"""
+    """
+    Decorator that causes ratelimiting for this command to be enforced more strictly
+    💡 Exact cost of the command can be set via tag: `@loader.tag(ratelimit_cost=10)`
+    """
     func.ratelimit = True
     return func
 
@@ -484,6 +478,8 @@ class Modules:
         self.inline_handlers = {}
         self.callback_handlers = {}
         self.aliases = {}
+        self._routes = None
+        self._revision = 0
         self.modules = []  # skipcq: PTC-W0052
         self.dragon_modules = []
         self.libraries = []
@@ -518,10 +514,16 @@ class Modules:
                 callback_handlers.update(module.hikka_callback_handlers)
                 watchers.extend(module.hikka_watchers.values())
 
-            self.commands = commands
+            if commands != self.commands:
+                self.commands = commands
+                self.invalidate_routes()
+
+            if watchers != self.watchers:
+                self.watchers = watchers
+                self.invalidate_watchers()
+
             self.inline_handlers = inline_handlers
             self.callback_handlers = callback_handlers
-            self.watchers = watchers
 
             logger.debug(
                 (
@@ -583,9 +585,6 @@ class Modules:
         modules: list,
         origin: str = "<core>",
     ) -> typing.List[Module]:
-        with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
-
         loaded = []
 
         for mod in modules:
@@ -659,9 +658,6 @@ class Modules:
         is_dragon: bool = False,
     ) -> typing.Union[Module, typing.Tuple[ModuleType, DragonModule]]:
         """Register single module from importlib spec"""
-        with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
-
         module = importlib.util.module_from_spec(spec)
         sys.modules[module_name] = module
         spec.loader.exec_module(module)
@@ -732,9 +728,6 @@ class Modules:
 
     def register_commands(self, instance: Module):
         """Register commands from instance"""
-        with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
-
         if instance.__origin__.startswith("<core"):
             self._core_commands += list(
                 map(lambda x: x.lower(), list(instance.hikka_commands))
@@ -758,6 +751,7 @@ class Modules:
             if cmd in instance.hikka_commands:
                 self.add_alias(alias, cmd)
 
+        self.invalidate_routes()
         self.register_inline_stuff(instance)
 
     def register_inline_stuff(self, instance: Module):
@@ -833,9 +827,6 @@ class Modules:
 
     def register_watchers(self, instance: Module):
         """Register watcher from instance"""
-        with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
-
         for _watcher in self.watchers:
             if _watcher.__self__.__class__.__name__ == instance.__class__.__name__:
                 logger.debug("Removing watcher %s for update", _watcher)
@@ -844,6 +835,8 @@ class Modules:
         for _watcher in instance.hikka_watchers.values():
             self.watchers += [_watcher]
 
+        self.invalidate_watchers()
+
     def lookup(
         self,
         modname: str,
@@ -896,9 +889,6 @@ class Modules:
 
     async def complete_registration(self, instance: Module):
         """Complete registration of instance"""
-        with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
-
         instance.allmodules = self
         instance.internal_init()
 
@@ -916,7 +906,8 @@ class Modules:
                     )
 
                 logger.debug("Removing module %s for update", module)
-                await module.on_unload()
+                with enter_module(module):
+                    await module.on_unload()
 
                 self.modules.remove(module)
                 for _, method in utils.iter_attrs(module):
@@ -939,13 +930,7 @@ class Modules:
             return None
 
         for command_name, _command in self.commands.items():
-            aliases = []
-            if getattr(_command, "alias", None) and not (
-                aliases := getattr(_command, "aliases", None)
-            ):
-                aliases = [_command.alias]
-
-            if not aliases:
+            if not (aliases := self._get_command_aliases(_command)):
                 continue
 
             if any(
@@ -960,21 +945,70 @@ class Modules:
 
         return None
 
+    @staticmethod
+    def _get_command_aliases(_command: Command) -> typing.List[str]:
+        aliases = []
+        if getattr(_command, "alias", None) and not (
+            aliases := getattr(_command, "aliases", None)
+        ):
+            aliases = [_command.alias]
+
+        return aliases or []
+
+    @property
+    def revision(self) -> int:
+        """Counter, which is increased every time commands, aliases or watchers change"""
+        return self._revision
+
+    def invalidate_routes(self):
+        """Drop compiled routing table, so it will be rebuilt on next dispatch"""
+        self._routes = None
+        self._revision += 1
+
+    def invalidate_watchers(self):
+        """Mark watchers as changed, so dispatcher will rebuild its watcher index"""
+        self._revision += 1
+
+    def _build_routes(
+        self,
+    ) -> typing.Dict[str, typing.Tuple[typing.Optional[str], Command]]:
+        """
+        Compile commands, legacy aliases and decorator aliases into a single
+        lookup table. Sources with lower priority are written first, so they
+        are overwritten by the ones with higher priority
+        """
+        routes = {}
+
+        for command_name, _command in self.commands.items():
+            for alias in self._get_command_aliases(_command):
+                if alias.lower() not in self._core_commands:
+                    routes.setdefault(alias.lower(), (command_name, _command))
+
+        for alias, cmd in self.aliases.items():
+            if cmd and cmd.lower() in self.commands:
+                routes[alias.lower()] = (cmd, self.commands[cmd.lower()])
+
+        for command_name, _command in self.commands.items():
+            # `None` means that command name is used the way it was typed
+            routes[command_name.lower()] = (None, _command)
+
+        return routes
+
+    @property
+    def routes(self) -> typing.Dict[str, typing.Tuple[typing.Optional[str], Command]]:
+        """Compiled routing table of commands and aliases"""
+        if self._routes is None:
+            self._routes = self._build_routes()
+
+        return self._routes
+
     def dispatch(self, _command: str) -> typing.Tuple[str, typing.Optional[str]]:
         """Dispatch command to appropriate module"""
+        if not (route := self.routes.get(_command.lower())):
+            return _command, None
 
-        return next(
-            (
-                (cmd, self.commands[cmd.lower()])
-                for cmd in [
-                    _command,
-                    self.aliases.get(_command.lower()),
-                    self.find_alias(_command),
-                ]
-                if cmd and cmd.lower() in self.commands
-            ),
-            (_command, None),
-        )
+        cmd, func = route
+        return cmd or _command, func
 
     def send_config(self, skip_hook: bool = False):
         """Configure modules"""
@@ -983,9 +1017,6 @@ class Modules:
 
     def send_config_one(self, mod: Module, skip_hook: bool = False):
         """Send config to single instance"""
-        with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
-
         if hasattr(mod, "config"):
             modcfg = self._db.get(
                 mod.__class__.__name__,
@@ -1024,7 +1055,8 @@ class Modules:
         mod.translator = self.translator
 
         try:
-            mod.config_complete()
+            with enter_module(mod):
+                mod.config_complete()
         except Exception as e:
             logger.exception("Failed to send mod config complete signal due to %s", e)
             raise
@@ -1049,23 +1081,22 @@ class Modules:
         no_self_unload: bool = False,
         from_dlmod: bool = False,
     ):
-        with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
-
         if from_dlmod:
             try:
-                if len(inspect.signature(mod.on_dlmod).parameters) == 2:
-                    await mod.on_dlmod(self.client, self._db)
-                else:
-                    await mod.on_dlmod()
+                with enter_module(mod):
+                    if len(inspect.signature(mod.on_dlmod).parameters) == 2:
+                        await mod.on_dlmod(self.client, self._db)
+                    else:
+                        await mod.on_dlmod()
             except Exception:
                 logger.info("Can't process `on_dlmod` hook", exc_info=True)
 
         try:
-            if len(inspect.signature(mod.client_ready).parameters) == 2:
-                await mod.client_ready(self.client, self._db)
-            else:
-                await mod.client_ready()
+            with enter_module(mod):
+                if len(inspect.signature(mod.client_ready).parameters) == 2:
+                    await mod.client_ready(self.client, self._db)
+                else:
+                    await mod.client_ready()
         except SelfUnload as e:
             if no_self_unload:
                 raise e
@@ -1120,9 +1151,6 @@ class Modules:
         """Remove module and all stuff from it"""
         worked = []
 
-        with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
-
         for module in self.modules:
             if classname.lower() in (
                 module.name.lower(),
@@ -1148,7 +1176,8 @@ class Modules:
                 logger.debug("Removing module %s for unload", module)
                 self.modules.remove(module)
 
-                await module.on_unload()
+                with enter_module(module):
+                    await module.on_unload()
 
                 self.unregister_raw_handlers(module, "unload")
                 self.unregister_loops(module, "unload")
@@ -1184,6 +1213,8 @@ class Modules:
                     if _command == name:
                         del self.aliases[alias]
 
+        self.invalidate_routes()
+
     def unregister_watchers(self, instance: Module, purpose: str):
         for _watcher in self.watchers.copy():
             if _watcher.__self__.__class__.__name__ == instance.__class__.__name__:
@@ -1195,6 +1226,8 @@ class Modules:
                 )
                 self.watchers.remove(_watcher)
 
+        self.invalidate_watchers()
+
     def unregister_raw_handlers(self, instance: Module, purpose: str):
         """Unregister event handlers for a module"""
         for handler in self.client.dispatcher.raw_handlers:
@@ -1213,10 +1246,12 @@ class Modules:
             return False
 
         self.aliases[alias.lower().strip()] = cmd
+        self.invalidate_routes()
         return True
 
     def remove_alias(self, alias: str) -> bool:
         """Remove an alias"""
+        self.invalidate_routes()
         return bool(self.aliases.pop(alias.lower().strip(), None))
 
     async def log(self, *args, **kwargs):
@@ -1228,7 +1263,8 @@ class Modules:
 
         for module in self.modules:
             try:
-                module.config_complete(reload_dynamic_translate=True)
+                with enter_module(module):
+                    module.config_complete(reload_dynamic_translate=True)
             except Exception as e:
                 logger.debug(
                     "Can't complete dynamic translations reload of %s due to %s",
@@ -7,7 +7,7 @@
 # 🔑 https://www.gnu.org/licenses/agpl-3.0.html
 
 import asyncio
-import inspect
+import collections
 import io
 import linecache
 import logging
@@ -21,6 +21,7 @@ import hikkatl
 from aiogram.utils.exceptions import NetworkError
 
 from . import utils
+from ._context import get_client_id
 from .tl_cache import CustomTelegramClient
 from .types import BotInlineCall, Module
 from .web.debugger import WebDebugger
@@ -93,7 +94,7 @@ class HikkaException:
         exc_type: object,
         exc_value: Exception,
         tb: traceback.TracebackException,
-        stack: typing.Optional[typing.List[inspect.FrameInfo]] = None,
+        stack: typing.Optional[list] = None,  # Unused, caller is taken from context
         comment: typing.Optional[typing.Any] = None,
     ) -> "HikkaException":
         def to_hashable(dictionary: dict) -> dict:
@@ -157,7 +158,7 @@ class HikkaException:
             ]
         )
 
-        caller = utils.find_caller(stack or inspect.stack())
+        caller = utils.find_caller()
 
         return cls(
             message=override_text(exc_value)
@@ -212,8 +213,8 @@ class TelegramLogsHandler(logging.Handler):
 
     def __init__(self, targets: list, capacity: int):
         super().__init__(0)
-        self.buffer = []
-        self.handledbuffer = []
+        self.buffer = collections.deque()
+        self.handledbuffer = collections.deque()
         self._queue = []
         self._mods = {}
         self.tg_buff = []
@@ -247,7 +248,7 @@ class TelegramLogsHandler(logging.Handler):
 
     def dump(self):
         """Return a list of logging entries"""
-        return self.handledbuffer + self.buffer
+        return [*self.handledbuffer, *self.buffer]
 
     def dumps(
         self,
@@ -257,7 +258,7 @@ class TelegramLogsHandler(logging.Handler):
         """Return all entries of minimum level as list of strings"""
         return [
             self.targets[0].format(record)
-            for record in (self.buffer + self.handledbuffer)
+            for record in [*self.buffer, *self.handledbuffer]
             if record.levelno >= lvl
             and (not record.hikka_caller or client_id == record.hikka_caller)
         ]
@@ -424,33 +425,12 @@ class TelegramLogsHandler(logging.Handler):
                         )
 
     def emit(self, record: logging.LogRecord):
-        try:
-            caller = next(
-                (
-                    frame_info.frame.f_locals["_hikka_client_id_logging_tag"]
-                    for frame_info in inspect.stack()
-                    if isinstance(
-                        getattr(getattr(frame_info, "frame", None), "f_locals", {}).get(
-                            "_hikka_client_id_logging_tag"
-                        ),
-                        int,
-                    )
-                ),
-                False,
-            )
-
-            if not isinstance(caller, int):
-                caller = None
-        except Exception:
-            caller = None
-
-        record.hikka_caller = caller
+        record.hikka_caller = caller = get_client_id()
 
         if record.levelno >= self.tg_level:
             if record.exc_info:
                 exc = HikkaException.from_exc_info(
                     *record.exc_info,
-                    stack=record.__dict__.get("stack", None),
                     comment=record.msg % record.args,
                 )
 
@@ -479,20 +459,21 @@ class TelegramLogsHandler(logging.Handler):
         self.buffer.append(record)
 
         if record.levelno >= self.lvl >= 0:
-            self.acquire()
-            try:
-                for precord in self.buffer:
-                    for target in self.targets:
-                        if record.levelno >= target.level:
+            # Buffered records are flushed to targets, which accept the current
+            # one, so skip formatting, if there are no such targets
+            if targets := [
+                target for target in self.targets if record.levelno >= target.level
+            ]:
+                self.acquire()
+                try:
+                    for precord in self.buffer:
+                        for target in targets:
                             target.handle(precord)
+                finally:
+                    self.release()
 
-                self.handledbuffer = (
-                    self.handledbuffer[-(self.capacity - len(self.buffer)) :]
-                    + self.buffer
-                )
-                self.buffer = []
-            finally:
-                self.release()
+            self.handledbuffer.extend(self.buffer)
+            self.buffer.clear()
 
 
 _main_formatter = logging.Formatter(
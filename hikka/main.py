@@ -59,6 +59,7 @@ from hikkatl.tl.functions.account import GetPasswordRequest
 from hikkatl.tl.functions.auth import CheckPasswordRequest
 
 from . import database, loader, utils, version
+from ._context import enter_client
 from ._internal import print_banner
 from .dispatcher import CommandDispatcher
 from .qr import QRCode
@@ -727,8 +728,9 @@ class Hikka:
             client._tg_id = me.id
             client.tg_id = me.id
             client.hikka_me = me
-            while await self.amain(first, client):
-                first = False
+            with enter_client(client):
+                while await self.amain(first, client):
+                    first = False
 
     async def _badge(self, client: CustomTelegramClient):
         """Call the badge in shell"""
@@ -834,6 +836,11 @@ class Hikka:
         client.hikka_db = db
         await db.init()
 
+        if db.get(__name__, "persist_cache", True):
+            asyncio.ensure_future(
+                client.load_hikka_cache(BASE_PATH / f"cache-{client.tg_id}.db")
+            )
+
         logging.debug("Got DB")
         logging.debug("Loading logging config...")
 
@@ -93,6 +93,7 @@ class HikkaInfoMod(loader.Module):
                 cpu_usage=utils.get_cpu_usage(),
                 ram_usage=f"{utils.get_ram_usage()} MB",
                 branch=version.branch,
+                cache_hit_rate=self._get_cache_hit_rate(),
             )
             if self.config["custom_message"]
             else (
@@ -129,6 +130,12 @@ class HikkaInfoMod(loader.Module):
             )
         )
 
+    def _get_cache_hit_rate(self) -> str:
+        stats = self._client.hikka_cache_stats.values()
+        hits = sum(cache["hits"] for cache in stats)
+        misses = sum(cache["misses"] for cache in stats)
+        return f"{hits / (hits + misses):.0%}" if hits + misses else "—"
+
     def _get_mark(self):
         return (
             {
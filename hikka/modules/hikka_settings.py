@@ -872,24 +872,22 @@ class HikkaSettingsMod(loader.Module):
 
         if module == "core":
             if method == "flush_entity_cache":
-                result = (
-                    f"Dropped {len(self._client._hikka_entity_cache)} cache records"
-                )
-                self._client._hikka_entity_cache = {}
+                result = f"Dropped {len(self._client.hikka_entity_cache)} cache records"
+                self._client.hikka_entity_cache.clear()
             elif method == "flush_fulluser_cache":
                 result = (
-                    f"Dropped {len(self._client._hikka_fulluser_cache)} cache records"
+                    f"Dropped {len(self._client.hikka_fulluser_cache)} cache records"
                 )
-                self._client._hikka_fulluser_cache = {}
+                self._client.hikka_fulluser_cache.clear()
             elif method == "flush_fullchannel_cache":
                 result = (
-                    f"Dropped {len(self._client._hikka_fullchannel_cache)} cache"
+                    f"Dropped {len(self._client.hikka_fullchannel_cache)} cache"
                     " records"
                 )
-                self._client._hikka_fullchannel_cache = {}
+                self._client.hikka_fullchannel_cache.clear()
             elif method == "flush_perms_cache":
-                result = f"Dropped {len(self._client._hikka_perms_cache)} cache records"
-                self._client._hikka_perms_cache = {}
+                result = f"Dropped {len(self._client.hikka_perms_cache)} cache records"
+                self._client.hikka_perms_cache.clear()
             elif method == "flush_loader_cache":
                 result = (
                     f"Dropped {await self.lookup('loader').flush_cache()} cache records"
@@ -897,29 +895,31 @@ class HikkaSettingsMod(loader.Module):
             elif method == "flush_cache":
                 count = self.lookup("loader").flush_cache()
                 result = (
-                    f"Dropped {len(self._client._hikka_entity_cache)} entity cache"
+                    f"Dropped {len(self._client.hikka_entity_cache)} entity cache"
                     " records\nDropped"
-                    f" {len(self._client._hikka_fulluser_cache)} fulluser cache"
+                    f" {len(self._client.hikka_fulluser_cache)} fulluser cache"
                     " records\nDropped"
-                    f" {len(self._client._hikka_fullchannel_cache)} fullchannel cache"
+                    f" {len(self._client.hikka_fullchannel_cache)} fullchannel cache"
                     " records\nDropped"
                     f" {count} loader links cache records"
                 )
-                self._client._hikka_entity_cache = {}
-                self._client._hikka_fulluser_cache = {}
-                self._client._hikka_fullchannel_cache = {}
+                self._client.hikka_entity_cache.clear()
+                self._client.hikka_fulluser_cache.clear()
+                self._client.hikka_fullchannel_cache.clear()
                 self._client.hikka_me = await self._client.get_me()
             elif method == "reload_core":
                 core_quantity = await self.lookup("loader").reload_core()
                 result = f"Reloaded {core_quantity} core modules"
             elif method == "inspect_cache":
-                result = (
-                    "Entity cache:"
-                    f" {len(self._client._hikka_entity_cache)} records\nFulluser cache:"
-                    f" {len(self._client._hikka_fulluser_cache)} records\nFullchannel"
-                    " cache:"
-                    f" {len(self._client._hikka_fullchannel_cache)} records\nLoader"
-                    f" links cache: {self.lookup('loader').inspect_cache()} records"
+                result = "\n".join(
+                    f"{name.capitalize()} cache: {stats['size']}/{stats['max_size']}"
+                    f" records, {stats['hit_rate']:.0%} hit rate"
+                    f" ({stats['hits']} hits, {stats['misses']} misses),"
+                    f" {stats['evictions']} evicted, {stats['expirations']} expired"
+                    for name, stats in self._client.hikka_cache_stats.items()
+                ) + (
+                    f"\nLoader links cache: {self.lookup('loader').inspect_cache()}"
+                    " records"
                 )
             elif method == "inspect_modules":
                 result = (
@@ -275,3 +275,13 @@ class CoreMod(loader.Module):
         self._db.clear()
         self._db.save()
         await utils.answer(call, self.strings("db_cleared"))
+
+    @loader.command()
+    async def verifydb(self, message: Message):
+        try:
+            self._db.verify()
+        except RuntimeError:
+            await utils.answer(message, self.strings("db_rolled_back"))
+            return
+
+        await utils.answer(message, self.strings("db_verified"))
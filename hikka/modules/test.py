@@ -98,8 +98,8 @@ class TestMod(loader.Module):
     @loader.command()
     async def clearlogs(self, message: Message):
         for handler in logging.getLogger().handlers:
-            handler.buffer = []
-            handler.handledbuffer = []
+            handler.buffer.clear()
+            handler.handledbuffer.clear()
             handler.tg_buff = ""
 
         await utils.answer(message, self.strings("logs_cleared"))
@@ -121,6 +121,9 @@ class UpdaterMod(loader.Module):
 
         await self._db.remote_force_save()
 
+        for client in self.allclients:
+            await client.save_hikka_cache()
+
         if "LAVHOST" in os.environ:
             os.system("lavhost restart")
             return
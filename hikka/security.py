@@ -22,18 +22,20 @@
 # You can redistribute it and/or modify it under the terms of the GNU AGPLv3
 # 🔑 https://www.gnu.org/licenses/agpl-3.0.html
 
+import asyncio
+import collections
+import heapq
 import logging
 import time
 import typing
 
 from hikkatl.hints import EntityLike
-from hikkatl.tl.functions.messages import GetFullChatRequest
 from hikkatl.tl.types import ChatParticipantAdmin, ChatParticipantCreator, Message
 from hikkatl.utils import get_display_name
 
 from . import main, utils
 from .database import Database
-from .tl_cache import CustomTelegramClient
+from .tl_cache import EDIT_LOG_TTL, CustomTelegramClient
 from .types import Command
 
 logger = logging.getLogger(__name__)
@@ -92,6 +94,44 @@ class SecurityGroup(typing.NamedTuple):
     permissions: typing.List[dict]
 
 
+Rule = typing.Tuple[str, str]
+
+
+class PermissionIndex(typing.NamedTuple):
+    """
+    Compiled security settings, rebuilt only when rules, security groups,
+    owners or masks change, or when the nearest timed rule expires
+    """
+
+    owners: typing.FrozenSet[int]
+    blacklist_users: typing.FrozenSet[int]
+    masks: typing.Dict[str, int]
+    bounding_mask: int
+    sgroup_rules: typing.Dict[int, typing.FrozenSet[Rule]]
+    user_rules: typing.Dict[int, typing.FrozenSet[Rule]]
+    chat_rules: typing.Dict[int, typing.FrozenSet[Rule]]
+    expires: float
+
+    def sgroup_match(self, user_id: int, rules: typing.Set[Rule]) -> bool:
+        return not rules.isdisjoint(self.sgroup_rules.get(user_id, ()))
+
+    def user_match(self, user_id: int, rules: typing.Set[Rule]) -> bool:
+        return not rules.isdisjoint(self.user_rules.get(user_id, ()))
+
+    def chat_match(self, chat_id: int, rules: typing.Set[Rule]) -> bool:
+        return not rules.isdisjoint(self.chat_rules.get(chat_id, ()))
+
+
+def _index_rules(
+    rules: typing.Iterable[typing.Tuple[int, str, str]],
+) -> typing.Dict[int, typing.FrozenSet[Rule]]:
+    index = collections.defaultdict(set)
+    for target, rule_type, rule in rules:
+        index[target].add((rule_type, rule))
+
+    return {target: frozenset(rules) for target, rules in index.items()}
+
+
 def owner(func: Command) -> Command:
     return _sec(func, OWNER)
 
@@ -168,7 +208,6 @@ class SecurityManager:
     def __init__(self, client: CustomTelegramClient, db: Database):
         self._client = client
         self._db = db
-        self._cache: typing.Dict[int, dict] = {}
         self._last_warning: int = 0
         self._sgroups: typing.Dict[str, SecurityGroup] = {}
 
@@ -177,29 +216,170 @@ class SecurityManager:
         self._tsec_chat = self.tsec_chat = db.pointer(__name__, "tsec_chat", [])
         self._tsec_user = self.tsec_user = db.pointer(__name__, "tsec_user", [])
         self._owner = self.owner = db.pointer(__name__, "owner", [])
+        self._index: typing.Optional[PermissionIndex] = None
+        self._index_revision: typing.Optional[tuple] = None
+        self._sgroups_revision = 0
+        self._expiry_heap: typing.List[typing.Tuple[int, str]] = []
+        self._expiry_timer: typing.Optional[asyncio.TimerHandle] = None
 
         self._reload_rights()
+        self._schedule_expiry()
 
     def apply_sgroups(self, sgroups: typing.Dict[str, SecurityGroup]):
         """Apply security groups"""
         self._sgroups = sgroups
+        self._sgroups_revision += 1
+
+    def _revision(self) -> tuple:
+        return (
+            self._db.revision(__name__),
+            self._db.revision(main.__name__),
+            self._sgroups_revision,
+        )
+
+    def _build_index(self) -> PermissionIndex:
+        # Rules, which expired before the timer removed them, are skipped
+        now = time.time()
+        return PermissionIndex(
+            owners=frozenset(self._owner),
+            blacklist_users=frozenset(
+                self._db.get(main.__name__, "blacklist_users", [])
+            ),
+            masks=dict(self._db.get(__name__, "masks", {})),
+            bounding_mask=self._db.get(__name__, "bounding_mask", DEFAULT_PERMISSIONS),
+            sgroup_rules=_index_rules(
+                (user, permission["rule_type"], permission["rule"])
+                for info in self._sgroups.values()
+                for user in info.users
+                for permission in info.permissions
+            ),
+            user_rules=_index_rules(
+                (info["target"], info["rule_type"], info["rule"])
+                for info in self._tsec_user
+                if not info["expires"] or info["expires"] >= now
+            ),
+            chat_rules=_index_rules(
+                (info["target"], info["rule_type"], info["rule"])
+                for info in self._tsec_chat
+                if not info["expires"] or info["expires"] >= now
+            ),
+            expires=min(
+                (expires for expires, _ in self._expiry_heap if expires >= now),
+                default=float("inf"),
+            ),
+        )
+
+    @property
+    def index(self) -> PermissionIndex:
+        """
+        Permission index. Rebuilt only when security settings change in
+        database, so the common check path costs several set lookups
+        """
+        if (
+            self._index is None
+            or self._index.expires < time.time()
+            or self._revision() != self._index_revision
+        ):
+            self._reload_rights()
+            self._schedule_expiry()
+            self._index = self._build_index()
+            self._index_revision = self._revision()
+            logger.debug(
+                "Rebuilt permission index for revision %s",
+                self._index_revision,
+            )
+
+        return self._index
 
     def _reload_rights(self):
         """
-        Internal method to ensure that account owner is always in the owner list
-        and to clear out outdated tsec rules
+        Internal method to ensure that account owner is always in the owner list.
+        Outdated tsec rules are removed by `_expire_rules`
         """
 
         if self._client.tg_id not in self._owner:
             self._owner.append(self._client.tg_id)
 
-        for info in self._tsec_user.copy():
-            if info["expires"] and info["expires"] < time.time():
-                self._tsec_user.remove(info)
+    def _schedule_expiry(self):
+        """
+        Rebuild the heap of timed tsec rules
+        and set the timer for the nearest of them
+        """
+        self._expiry_heap = [
+            (info["expires"], target_type)
+            for target_type, rules in (
+                ("user", self._tsec_user),
+                ("chat", self._tsec_chat),
+            )
+            for info in rules
+            if info["expires"]
+        ]
+        heapq.heapify(self._expiry_heap)
+
+        if self._expiry_timer is not None:
+            self._expiry_timer.cancel()
+            self._expiry_timer = None
+
+        if not self._expiry_heap:
+            return
+
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Expired rules are still skipped by index
+            return
+
+        self._expiry_timer = loop.call_later(
+            max(0, self._expiry_heap[0][0] - time.time()),
+            self._expire_rules,
+        )
+
+    def _expire_rules(self):
+        """Remove all expired tsec rules with a single write per list"""
+        self._expiry_timer = None
+        now = time.time()
+        target_types = set()
+
+        while self._expiry_heap and self._expiry_heap[0][0] <= now:
+            target_types.add(heapq.heappop(self._expiry_heap)[1])
+
+        for target_type in target_types:
+            self._remove_rules_where(
+                target_type,
+                lambda info: info["expires"] and info["expires"] <= now,
+            )
+
+        logger.debug("Removed expired %s tsec rules", ", ".join(target_types))
+
+        # Index is rebuilt on the next check, because writes change revision
+        self._schedule_expiry()
+
+    def _remove_rules_where(
+        self,
+        target_type: str,
+        predicate: typing.Callable[[dict], bool],
+    ) -> bool:
+        """
+        Remove tsec rules, matching the predicate, with a single database write
+
+        :param target_type: "user" or "chat"
+        :param predicate: Function, which returns `True` for rules to remove
+        :return: True if any rules were removed
+        """
+        if target_type == "user":
+            rules = self._tsec_user
+        elif target_type == "chat":
+            rules = self._tsec_chat
+        else:
+            return False
+
+        if len(remaining := [info for info in rules if not predicate(info)]) == len(
+            rules
+        ):
+            return False
 
-        for info in self._tsec_chat.copy():
-            if info["expires"] and info["expires"] < time.time():
-                self._tsec_chat.remove(info)
+        rules[:] = remaining
+        return True
 
     def add_rule(
         self,
@@ -241,6 +421,9 @@ class SecurityManager:
             }
         )
 
+        if duration:
+            self._schedule_expiry()
+
     def remove_rules(self, target_type: str, target_id: int) -> bool:
         """
         Removes all targeted security rules for the given target
@@ -250,20 +433,10 @@ class SecurityManager:
         :return: True if any rules were removed
         """
 
-        any_ = False
-
-        if target_type == "user":
-            for rule in self.tsec_user.copy():
-                if rule["target"] == target_id:
-                    self.tsec_user.remove(rule)
-                    any_ = True
-        elif target_type == "chat":
-            for rule in self.tsec_chat.copy():
-                if rule["target"] == target_id:
-                    self.tsec_chat.remove(rule)
-                    any_ = True
-
-        return any_
+        return self._remove_rules_where(
+            target_type,
+            lambda rule: rule["target"] == target_id,
+        )
 
     def remove_rule(self, target_type: str, target_id: int, rule_cont: str) -> bool:
         """
@@ -275,20 +448,10 @@ class SecurityManager:
         :return: True if any rules were removed
         """
 
-        any_ = False
-
-        if target_type == "user":
-            for rule in self.tsec_user.copy():
-                if rule["target"] == target_id and rule["rule"] == rule_cont:
-                    self.tsec_user.remove(rule)
-                    any_ = True
-        elif target_type == "chat":
-            for rule in self.tsec_chat.copy():
-                if rule["target"] == target_id and rule["rule"] == rule_cont:
-                    self.tsec_chat.remove(rule)
-                    any_ = True
-
-        return any_
+        return self._remove_rules_where(
+            target_type,
+            lambda rule: rule["target"] == target_id and rule["rule"] == rule_cont,
+        )
 
     def get_flags(self, func: typing.Union[Command, int]) -> int:
         """
@@ -298,6 +461,8 @@ class SecurityManager:
         :return: security flags
         """
 
+        index = self.index
+
         if isinstance(func, int):
             config = func
         else:
@@ -305,7 +470,7 @@ class SecurityManager:
             # every time he changes permissions. It doesn't
             # decrease security at all, bc user anyway can
             # access this attribute
-            config = self._db.get(__name__, "masks", {}).get(
+            config = index.masks.get(
                 f"{func.__module__}.{func.__name__}",
                 getattr(func, "security", self._default),
             )
@@ -314,7 +479,7 @@ class SecurityManager:
             logger.error("Security config contains unknown bits")
             return False
 
-        return config & self._db.get(__name__, "bounding_mask", DEFAULT_PERMISSIONS)
+        return config & index.bounding_mask
 
     def _check_tsec_inline(self, user_id: int, command: str) -> bool:
         """
@@ -325,39 +490,24 @@ class SecurityManager:
         :return: True if permitted, False otherwise
         """
 
-        return command and any(
-            (
-                rule["target"] == user_id
-                and rule["rule_type"] == "inline"
-                and rule["rule"] == command
-            )
-            for rule in self._tsec_user
-        )
+        return bool(command) and self.index.user_match(user_id, {("inline", command)})
 
     def check_tsec(self, user_id: int, command: str) -> bool:
-        for info in self._sgroups.copy().values():
-            if user_id in info.users:
-                for permission in info.permissions:
-                    if (
-                        permission["rule_type"] == "command"
-                        and permission["rule"] == command
-                        or permission["rule_type"] == "module"
-                        and permission["rule"] == command
-                    ):
-                        return True
-
-        for info in self._tsec_user.copy():
-            if info["target"] == user_id and (
-                info["rule_type"] == "command"
-                and info["rule"] == command
-                or info["rule_type"] == "module"
-                and command in self._client.loader.commands
-                and info["rule"]
-                == self._client.loader.commands[command].__qualname__.split(".")[0]
-            ):
-                return True
+        index = self.index
 
-        return False
+        if index.sgroup_match(user_id, {("command", command), ("module", command)}):
+            return True
+
+        rules = {("command", command)}
+        if command in self._client.loader.commands:
+            rules.add(
+                (
+                    "module",
+                    self._client.loader.commands[command].__qualname__.split(".")[0],
+                )
+            )
+
+        return index.user_match(user_id, rules)
 
     async def check(
         self,
@@ -378,7 +528,7 @@ class SecurityManager:
         :return: True if permitted, False otherwise
         """
 
-        self._reload_rights()
+        index = self.index
 
         if not (config := self.get_flags(func)):
             return False
@@ -394,14 +544,13 @@ class SecurityManager:
             and not message.is_group
             and message.edit_date
         ):
-            async for event in self._client.iter_admin_log(
-                utils.get_chat_id(message),
-                limit=10,
-                edit=True,
-            ):
-                if event.action.prev_message.id == message.id:
-                    user_id = event.user_id
-                    is_channel = True
+            editor = await self._client.get_edit_author_cached(
+                message,
+                self._db.get(main.__name__, "edit_log_ttl", EDIT_LOG_TTL),
+            )
+            if editor is not None:
+                user_id = editor
+                is_channel = True
 
         if (
             user_id == self._client.tg_id
@@ -446,10 +595,10 @@ class SecurityManager:
             or f_group_admin
         )
 
-        if user_id in self._owner:
+        if user_id in index.owners:
             return True
 
-        if user_id in self._db.get(main.__name__, "blacklist_users", []):
+        if user_id in index.blacklist_users:
             return False
 
         if message is None:  # In case of checking inline query security map
@@ -462,83 +611,50 @@ class SecurityManager:
         except Exception:
             chat = None
 
-        try:
-            cmd = message.raw_text[1:].split()[0].strip()
-            if usernames:
-                for username in usernames:
-                    cmd = cmd.replace(f"@{username}", "")
-        except Exception:
-            cmd = None
+        if (
+            parsed := getattr(message, "hikka_command", None)
+        ) is not None and parsed.is_valid_for(message):
+            # Command is already parsed by dispatcher
+            cmd, command = parsed.name, parsed.resolved
+        else:
+            command = None
+            try:
+                cmd = message.raw_text[1:].split()[0].strip()
+                if usernames:
+                    for username in usernames:
+                        cmd = cmd.replace(f"@{username}", "")
+            except Exception:
+                cmd = None
 
         if callable(func):
-            command = self._client.loader.find_alias(cmd, include_legacy=True) or cmd
-
-            for info in self._sgroups.copy().values():
-                if user_id in info.users:
-                    for permission in info.permissions:
-                        if (
-                            permission["rule_type"] == "command"
-                            and permission["rule"] == command
-                        ):
-                            logger.debug("sgroup match for %s", command)
-                            return True
-
-                        if (
-                            permission["rule_type"] == "module"
-                            and permission["rule"] == func.__self__.__class__.__name__
-                        ):
-                            logger.debug(
-                                "sgroup match for %s", func.__self__.__class__.__name__
-                            )
-                            return True
-
-            for info in self._tsec_user.copy():
-                if info["target"] == user_id:
-                    if info["rule_type"] == "command" and info["rule"] == command:
-                        logger.debug("tsec match for user %s", command)
-                        return True
-
-                    if (
-                        info["rule_type"] == "module"
-                        and info["rule"] == func.__self__.__class__.__name__
-                    ):
-                        logger.debug(
-                            "tsec match for user %s",
-                            func.__self__.__class__.__name__,
-                        )
-                        return True
-
-            if chat:
-                for info in self._tsec_chat.copy():
-                    if info["target"] == chat:
-                        if info["rule_type"] == "command" and info["rule"] == command:
-                            logger.debug("tsec match for %s", command)
-                            return True
-
-                        if (
-                            info["rule_type"] == "module"
-                            and info["rule"] == func.__self__.__class__.__name__
-                        ):
-                            logger.debug(
-                                "tsec match for %s",
-                                func.__self__.__class__.__name__,
-                            )
-                            return True
+            command = (
+                command
+                or self._client.loader.find_alias(cmd, include_legacy=True)
+                or cmd
+            )
+            rules = {
+                ("command", command),
+                ("module", func.__self__.__class__.__name__),
+            }
+
+            if index.sgroup_match(user_id, rules):
+                logger.debug("sgroup match for %s", command)
+                return True
+
+            if index.user_match(user_id, rules):
+                logger.debug("tsec match for user %s", command)
+                return True
+
+            if chat and index.chat_match(chat, rules):
+                logger.debug("tsec match for %s", command)
+                return True
 
         if f_group_member and message.is_group or f_pm and message.is_private:
             return True
 
         if message.is_channel:
             if not message.is_group:
-                chat_id = utils.get_chat_id(message)
-                if (
-                    chat_id in self._cache
-                    and self._cache[chat_id]["exp"] >= time.time()
-                ):
-                    chat = self._cache[chat_id]["chat"]
-                else:
-                    chat = await message.get_chat()
-                    self._cache[chat_id] = {"chat": chat, "exp": time.time() + 5 * 60}
+                chat = await message.get_chat()
 
                 if (
                     not chat.creator
@@ -551,22 +667,10 @@ class SecurityManager:
                 if self._any_admin and f_group_admin_any or f_group_admin:
                     return True
             elif f_group_admin_any or f_group_owner:
-                chat_id = utils.get_chat_id(message)
-                cache_obj = f"{chat_id}/{user_id}"
-                if (
-                    cache_obj in self._cache
-                    and self._cache[cache_obj]["exp"] >= time.time()
-                ):
-                    participant = self._cache[cache_obj]["user"]
-                else:
-                    participant = await message.client.get_permissions(
-                        message.peer_id,
-                        user_id,
-                    )
-                    self._cache[cache_obj] = {
-                        "user": participant,
-                        "exp": time.time() + 5 * 60,
-                    }
+                participant = await self._client.get_perms_cached(
+                    message.peer_id,
+                    user_id,
+                )
 
                 if (
                     participant.is_creator
@@ -593,29 +697,11 @@ class SecurityManager:
             return False
 
         if message.is_group and (f_group_admin_any or f_group_owner):
-            chat_id = utils.get_chat_id(message)
-            cache_obj = f"{chat_id}/{user_id}"
-
-            if (
-                cache_obj in self._cache
-                and self._cache[cache_obj]["exp"] >= time.time()
-            ):
-                participant = self._cache[cache_obj]["user"]
-            else:
-                full_chat = await message.client(GetFullChatRequest(message.chat_id))
-                participants = full_chat.full_chat.participants.participants
-                participant = next(
-                    (
-                        possible_participant
-                        for possible_participant in participants
-                        if possible_participant.user_id == message.sender_id
-                    ),
-                    None,
+            participant = (
+                await self._client.get_chat_participants_cached(
+                    utils.get_chat_id(message)
                 )
-                self._cache[cache_obj] = {
-                    "user": participant,
-                    "exp": time.time() + 5 * 60,
-                }
+            ).get(user_id)
 
             if not participant:
                 return
@@ -4,39 +4,80 @@
 # You can redistribute it and/or modify it under the terms of the GNU AGPLv3
 # 🔑 https://www.gnu.org/licenses/agpl-3.0.html
 
+import asyncio
+import contextvars
 import copy
+import functools
 import inspect
+import json
 import logging
+import sqlite3
 import time
+import types
 import typing
+from pathlib import Path
 
 from hikkatl import TelegramClient
 from hikkatl.errors.rpcerrorlist import TopicDeletedError
+from hikkatl.extensions import BinaryReader
 from hikkatl.hints import EntityLike
 from hikkatl.network import MTProtoSender
+from hikkatl.tl.custom.chatgetter import ChatGetter
+from hikkatl.tl.custom.participantpermissions import ParticipantPermissions
+from hikkatl.tl.custom.sendergetter import SenderGetter
 from hikkatl.tl.functions.channels import GetFullChannelRequest
+from hikkatl.tl.functions.messages import GetFullChatRequest
 from hikkatl.tl.functions.users import GetFullUserRequest
 from hikkatl.tl.tlobject import TLRequest
 from hikkatl.tl.types import (
     ChannelFull,
+    ChatParticipant,
+    ChatParticipantAdmin,
+    ChatParticipants,
     Message,
+    UpdateChannelParticipant,
+    UpdateChatParticipantAdd,
+    UpdateChatParticipantAdmin,
+    UpdateChatParticipantDelete,
+    UpdateChatParticipants,
     Updates,
     UpdatesCombined,
     UpdateShort,
     UserFull,
 )
-from hikkatl.utils import is_list_like
+from hikkatl.utils import is_list_like, resolve_id
 
+from ._context import current_client, current_module
+from ._internal import on_shutdown
 from .types import (
+    CacheRecordEditLog,
     CacheRecordEntity,
     CacheRecordFullChannel,
     CacheRecordFullUser,
+    CacheRecordParticipants,
     CacheRecordPerms,
     Module,
+    TTLCache,
 )
 
 logger = logging.getLogger(__name__)
 
+# Maximum amount of records in each cache. Full objects are much heavier
+# than entities, so fewer of them are kept
+ENTITY_CACHE_SIZE = 10000
+PERMS_CACHE_SIZE = 10000
+FULLCHANNEL_CACHE_SIZE = 1000
+FULLUSER_CACHE_SIZE = 1000
+PARTICIPANTS_CACHE_SIZE = 1000
+EDIT_LOG_CACHE_SIZE = 100
+EDIT_LOG_TTL = 60
+# Interval (in seconds) of dropping expired records from caches
+CACHE_SWEEP_INTERVAL = 60
+# Maximum amount of entities, resolved by a single batched request
+ENTITIES_BATCH_SIZE = 200
+# Interval (in seconds) of saving entity and perms caches to disk
+CACHE_PERSIST_INTERVAL = 5 * 60
+
 
 def hashable(value: typing.Any) -> bool:
     """
@@ -53,31 +94,102 @@ def hashable(value: typing.Any) -> bool:
     return True
 
 
-class CustomTelegramClient(TelegramClient):
-    def __init__(self, *args, **kwargs):
-        super().__init__(*args, **kwargs)
+_frozen_classes: typing.Dict[type, type] = {}
 
-        self._hikka_entity_cache: typing.Dict[
-            typing.Union[str, int],
-            CacheRecordEntity,
-        ] = {}
 
-        self._hikka_perms_cache: typing.Dict[
-            typing.Union[str, int],
-            CacheRecordPerms,
-        ] = {}
+def _read_only(self, *_):
+    raise AttributeError(
+        f"Cached {type(self).__name__} is shared and read-only, request it with"
+        " `mutable=True` to modify it"
+    )
 
-        self._hikka_fullchannel_cache: typing.Dict[
-            typing.Union[str, int],
-            CacheRecordFullChannel,
-        ] = {}
 
-        self._hikka_fulluser_cache: typing.Dict[
-            typing.Union[str, int],
-            CacheRecordFullUser,
-        ] = {}
+def freeze(obj: typing.Any) -> typing.Any:
+    """
+    Make object read-only in place, so it can be shared from cache without
+    copying. Only attributes of the object itself are protected, nested
+    objects are not. Object stays an instance of its original class
 
-        self._forbidden_constructors: typing.List[int] = []
+    :param obj: Object to freeze
+    :return: The same object
+    """
+    cls = type(obj)
+    if cls in _frozen_classes.values():
+        return obj
+
+    if cls not in _frozen_classes:
+        _frozen_classes[cls] = type(
+            cls.__name__,
+            (cls,),
+            {
+                "__setattr__": _read_only,
+                "__delattr__": _read_only,
+                "__module__": cls.__module__,
+                "__qualname__": cls.__qualname__,
+            },
+        )
+
+    try:
+        object.__setattr__(obj, "__class__", _frozen_classes[cls])
+    except TypeError:
+        # E.g. built-in types or classes with incompatible layout
+        pass
+
+    return obj
+
+
+def thaw(obj: typing.Any) -> typing.Any:
+    """
+    Get mutable deep copy of frozen object
+
+    :param obj: Object to copy
+    :return: Copy of the object
+    """
+    obj = copy.deepcopy(obj)
+    if type(obj) in _frozen_classes.values():
+        object.__setattr__(obj, "__class__", type(obj).__base__)
+
+    return obj
+
+
+def _thawing_getter(getter: callable, attr: str) -> callable:
+    """
+    Make getter of message (e.g. `get_sender`) store mutable copy of entity,
+    if it was taken from the shared cache through `get_entity`, so modules
+    can still modify `message.sender` and `message.chat`
+    """
+
+    @functools.wraps(getter)
+    async def wrapper(self, *args, **kwargs):
+        result = await getter(self, *args, **kwargs)
+        if type(result) in _frozen_classes.values():
+            result = thaw(result)
+            setattr(self, attr, result)
+
+        return result
+
+    return wrapper
+
+
+SenderGetter.get_sender = _thawing_getter(SenderGetter.get_sender, "_sender")
+ChatGetter.get_chat = _thawing_getter(ChatGetter.get_chat, "_chat")
+
+
+class CustomTelegramClient(TelegramClient):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self._hikka_entity_cache: TTLCache = TTLCache(ENTITY_CACHE_SIZE)
+        self._hikka_perms_cache: TTLCache = TTLCache(PERMS_CACHE_SIZE)
+        self._hikka_fullchannel_cache: TTLCache = TTLCache(FULLCHANNEL_CACHE_SIZE)
+        self._hikka_fulluser_cache: TTLCache = TTLCache(FULLUSER_CACHE_SIZE)
+        self._hikka_participants_cache: TTLCache = TTLCache(PARTICIPANTS_CACHE_SIZE)
+        self._hikka_edit_log_cache: TTLCache = TTLCache(EDIT_LOG_CACHE_SIZE)
+        self._hikka_cache_sweeper: typing.Optional[asyncio.Future] = None
+        self._hikka_inflight: typing.Dict[typing.Hashable, asyncio.Future] = {}
+        self._hikka_cache_path: typing.Optional[Path] = None
+
+        self._forbidden_constructors: typing.FrozenSet[int] = frozenset()
 
         self._raw_updates_processor: typing.Optional[
             typing.Callable[
@@ -101,23 +213,265 @@ class CustomTelegramClient(TelegramClient):
         self._raw_updates_processor = value
 
     @property
-    def hikka_entity_cache(self) -> typing.Dict[int, CacheRecordEntity]:
+    def hikka_entity_cache(self) -> TTLCache:
         return self._hikka_entity_cache
 
     @property
-    def hikka_perms_cache(self) -> typing.Dict[int, CacheRecordPerms]:
+    def hikka_perms_cache(self) -> TTLCache:
         return self._hikka_perms_cache
 
     @property
-    def hikka_fullchannel_cache(self) -> typing.Dict[int, CacheRecordFullChannel]:
+    def hikka_fullchannel_cache(self) -> TTLCache:
         return self._hikka_fullchannel_cache
 
     @property
-    def hikka_fulluser_cache(self) -> typing.Dict[int, CacheRecordFullUser]:
+    def hikka_fulluser_cache(self) -> TTLCache:
         return self._hikka_fulluser_cache
 
     @property
-    def forbidden_constructors(self) -> typing.List[str]:
+    def hikka_participants_cache(self) -> TTLCache:
+        return self._hikka_participants_cache
+
+    @property
+    def hikka_edit_log_cache(self) -> TTLCache:
+        return self._hikka_edit_log_cache
+
+    @property
+    def hikka_caches(self) -> typing.Dict[str, TTLCache]:
+        return {
+            "entity": self._hikka_entity_cache,
+            "perms": self._hikka_perms_cache,
+            "fullchannel": self._hikka_fullchannel_cache,
+            "fulluser": self._hikka_fulluser_cache,
+            "participants": self._hikka_participants_cache,
+            "edit_log": self._hikka_edit_log_cache,
+        }
+
+    @property
+    def hikka_cache_stats(self) -> typing.Dict[str, typing.Dict[str, float]]:
+        """Size, hits, misses, evictions and expirations of each cache"""
+        return {name: cache.stats for name, cache in self.hikka_caches.items()}
+
+    def _cache_record(
+        self,
+        cache: TTLCache,
+        key: typing.Hashable,
+        record: typing.Any,
+        aliases: typing.Iterable[typing.Hashable] = (),
+    ):
+        cache.set(key, record, aliases)
+
+        if not self._hikka_cache_sweeper or self._hikka_cache_sweeper.done():
+            self._hikka_cache_sweeper = asyncio.ensure_future(self._sweep_caches())
+
+    async def load_hikka_cache(self, path: Path):
+        """
+        Load entity and perms caches, saved before restart, and save
+        them to the same file periodically and on shutdown.
+        Records, which have expired meanwhile, are skipped
+
+        :param path: Path to the cache file
+        """
+        self._hikka_cache_path = path
+
+        try:
+            rows = await asyncio.get_running_loop().run_in_executor(
+                None,
+                self._read_hikka_cache_sync,
+            )
+        except Exception:
+            logger.exception("Can't load persisted cache, starting with empty one")
+            rows = []
+
+        loaded = 0
+        for table, key, aliases, ts, exp, obj in rows:
+            if table == "entities":
+                cache = self._hikka_entity_cache
+                record = CacheRecordEntity(key, freeze(obj), 0)
+            else:
+                cache = self._hikka_perms_cache
+                record = CacheRecordPerms(*key, freeze(obj), 0)
+
+            # Records, fetched while loading, are fresher
+            if key in cache:
+                continue
+
+            record.ts, record._exp = ts, exp
+            self._cache_record(cache, key, record, aliases)
+            loaded += 1
+
+        logger.debug("Loaded %s persisted cache records", loaded)
+
+        on_shutdown(lambda: self._write_hikka_cache_sync(*self._snapshot_hikka_cache()))
+        asyncio.ensure_future(self._persist_hikka_cache())
+
+    async def save_hikka_cache(self):
+        """Save entity and perms caches to disk, if persistence is enabled"""
+        if not self._hikka_cache_path:
+            return
+
+        try:
+            await asyncio.get_running_loop().run_in_executor(
+                None,
+                self._write_hikka_cache_sync,
+                *self._snapshot_hikka_cache(),
+            )
+        except Exception:
+            logger.exception("Can't persist cache")
+
+    async def _persist_hikka_cache(self):
+        while True:
+            await asyncio.sleep(CACHE_PERSIST_INTERVAL)
+            await self.save_hikka_cache()
+
+    def _connect_hikka_cache(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self._hikka_cache_path)
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS entities (key TEXT PRIMARY KEY, aliases"
+            " TEXT, ts REAL, exp REAL, data BLOB)"
+        )
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS perms (key TEXT PRIMARY KEY, aliases TEXT,"
+            " ts REAL, exp REAL, data BLOB, is_chat INTEGER)"
+        )
+        return connection
+
+    @staticmethod
+    def _decode_cache_key(key: typing.Any) -> typing.Hashable:
+        # Tuples, which are used as perms keys, become lists in JSON
+        return tuple(key) if isinstance(key, list) else key
+
+    def _read_hikka_cache_sync(self) -> list:
+        rows = []
+        now = time.time()
+        connection = self._connect_hikka_cache()
+        try:
+            for table, query in (
+                ("entities", "SELECT key, aliases, ts, exp, data, 0 FROM entities"),
+                ("perms", "SELECT key, aliases, ts, exp, data, is_chat FROM perms"),
+            ):
+                for key, aliases, ts, exp, data, is_chat in connection.execute(
+                    f"{query} WHERE exp > ?",
+                    (now,),
+                ):
+                    obj = BinaryReader(data).tgread_object()
+                    if table == "perms":
+                        obj = ParticipantPermissions(obj, bool(is_chat))
+
+                    rows += [
+                        (
+                            table,
+                            self._decode_cache_key(json.loads(key)),
+                            [self._decode_cache_key(a) for a in json.loads(aliases)],
+                            ts,
+                            exp,
+                            obj,
+                        )
+                    ]
+        finally:
+            connection.close()
+
+        return rows
+
+    def _snapshot_hikka_cache(self) -> typing.Tuple[list, list]:
+        return (
+            [
+                (key, list(aliases), record.ts, record._exp, record.entity)
+                for key, record, aliases in self._hikka_entity_cache.items()
+            ],
+            [
+                (key, list(aliases), record.ts, record._exp, record.perms)
+                for key, record, aliases in self._hikka_perms_cache.items()
+                if isinstance(record.perms, ParticipantPermissions)
+            ],
+        )
+
+    def _write_hikka_cache_sync(self, entities: list, perms: list):
+        # Cached objects are read-only, so they can be
+        # serialized outside of the event loop
+        entities = [
+            (json.dumps(key), json.dumps(aliases), ts, exp, bytes(entity))
+            for key, aliases, ts, exp, entity in entities
+        ]
+        perms = [
+            (
+                json.dumps(key),
+                json.dumps(aliases),
+                ts,
+                exp,
+                bytes(permissions.participant),
+                permissions.is_chat,
+            )
+            for key, aliases, ts, exp, permissions in perms
+        ]
+
+        connection = self._connect_hikka_cache()
+        try:
+            with connection:
+                connection.execute("DELETE FROM entities")
+                connection.execute("DELETE FROM perms")
+                connection.executemany(
+                    "INSERT INTO entities VALUES (?, ?, ?, ?, ?)",
+                    entities,
+                )
+                connection.executemany(
+                    "INSERT INTO perms VALUES (?, ?, ?, ?, ?, ?)",
+                    perms,
+                )
+        finally:
+            connection.close()
+
+        logger.debug(
+            "Persisted %s entity and %s perms cache records",
+            len(entities),
+            len(perms),
+        )
+
+    async def _single_flight(
+        self,
+        key: typing.Hashable,
+        request: typing.Callable[[], typing.Awaitable[typing.Any]],
+    ) -> typing.Any:
+        """
+        Make request or join the same one, which is already in progress,
+        so concurrent callers share a single API call.
+        Request doesn't belong to any of the callers, so it runs in a context,
+        which only knows the client, not the module or command of the first caller
+
+        :param key: Key of the request
+        :param request: Function, which makes the request
+        :return: Result of the request
+        """
+        if (future := self._hikka_inflight.get(key)) is None:
+            context = contextvars.Context()
+            context.run(current_client.set, self)
+            future = context.run(asyncio.ensure_future, request())
+            self._hikka_inflight[key] = future
+
+            def done(_):
+                del self._hikka_inflight[key]
+                # Callers might have been cancelled, don't let
+                # the exception be reported as never retrieved
+                if not future.cancelled():
+                    future.exception()
+
+            future.add_done_callback(done)
+        else:
+            logger.debug("Joining in-flight request %s", key)
+
+        # Cancellation of one caller must not cancel request for the others
+        return await asyncio.shield(future)
+
+    async def _sweep_caches(self):
+        """Drop expired records from caches until they are empty"""
+        while any(self.hikka_caches.values()):
+            await asyncio.sleep(CACHE_SWEEP_INTERVAL)
+            for name, cache in self.hikka_caches.items():
+                if expired := cache.sweep():
+                    logger.debug("Dropped %s expired %s cache records", expired, name)
+
+    @property
+    def forbidden_constructors(self) -> typing.FrozenSet[int]:
         return self._forbidden_constructors
 
     async def force_get_entity(self, *args, **kwargs):
@@ -130,20 +484,105 @@ class CustomTelegramClient(TelegramClient):
         entity: EntityLike,
         exp: int = 5 * 60,
         force: bool = False,
+        mutable: bool = False,
     ):
         """
         Gets the entity and cache it
 
         :param entity: Entity to fetch
-        :param exp: Expiration time of the cache record and maximum time of already cached record
+        :param exp: Expiration time of the cache record and maximum time of already cached record.
+            `0` means that record never expires and cached record of any age is used
         :param force: Whether to force refresh the cache (make API request)
+        :param mutable: Whether to return a mutable copy of the entity. Otherwise,
+            the read-only instance, shared with the cache, is returned
         :return: :obj:`Entity`
         """
 
-        # Will be used to determine, which client caused logging messages
-        # parsed via inspect.stack()
-        _hikka_client_id_logging_tag = copy.copy(self.tg_id)  # noqa: F841
+        if (hashable_entity := self._get_hashable_entity(entity)) is None:
+            logger.debug(
+                "Can't parse hashable from entity %s, using legacy resolve",
+                entity,
+            )
+            return await TelegramClient.get_entity(self, entity)
+
+        if (
+            not force
+            and hashable_entity
+            and (cache_record := self._hikka_entity_cache.get(hashable_entity, exp))
+        ):
+            logger.debug(
+                "Using cached entity %s (%s)",
+                entity,
+                type(cache_record.entity).__name__,
+            )
+            return thaw(cache_record.entity) if mutable else cache_record.entity
+
+        resolved_entity = await self._single_flight(
+            ("entity", hashable_entity),
+            lambda: self._resolve_entity(entity, hashable_entity, exp),
+        )
+
+        return thaw(resolved_entity) if mutable else resolved_entity
+
+    async def get_entities(
+        self,
+        entities: typing.Iterable[EntityLike],
+        exp: int = 5 * 60,
+        force: bool = False,
+        mutable: bool = False,
+    ) -> list:
+        """
+        Gets several entities at once and cache them. Cached entities are taken
+        from memory, the rest are resolved with as few requests as possible
+
+        :param entities: Entities to fetch
+        :param exp: Expiration time of the cache records and maximum time of already cached records.
+            `0` means that records never expire and cached records of any age are used
+        :param force: Whether to force refresh the cache (make API requests)
+        :param mutable: Whether to return mutable copies of the entities. Otherwise,
+            the read-only instances, shared with the cache, are returned
+        :return: List of entities in the same order
+        """
+        entities = list(entities)
+        result = [None] * len(entities)
+        missing = {}
+
+        for i, entity in enumerate(entities):
+            hashable_entity = self._get_hashable_entity(entity)
+            if (
+                not force
+                and hashable_entity
+                and (cache_record := self._hikka_entity_cache.get(hashable_entity, exp))
+            ):
+                result[i] = cache_record.entity
+            else:
+                missing[i] = hashable_entity
+
+        logger.debug(
+            "Resolving %s of %s entities, the rest are cached",
+            len(missing),
+            len(entities),
+        )
+
+        indexes = list(missing)
+        for start in range(0, len(indexes), ENTITIES_BATCH_SIZE):
+            batch = indexes[start : start + ENTITIES_BATCH_SIZE]
+            # Telethon groups entities by type and fetches
+            # each group with a single request
+            resolved = await TelegramClient.get_entity(
+                self,
+                [entities[i] for i in batch],
+            )
+
+            for i, resolved_entity in zip(batch, resolved):
+                self._save_entity(missing[i], resolved_entity, exp)
+                result[i] = resolved_entity
+
+        return [thaw(entity) for entity in result] if mutable else result
 
+    @staticmethod
+    def _get_hashable_entity(entity: EntityLike) -> typing.Optional[typing.Hashable]:
+        """Get key of entity in cache or `None` if it can't be determined"""
         if not hashable(entity):
             try:
                 hashable_entity = next(
@@ -152,53 +591,54 @@ class CustomTelegramClient(TelegramClient):
                     if getattr(entity, attr, None)
                 )
             except StopIteration:
-                logger.debug(
-                    "Can't parse hashable from entity %s, using legacy resolve",
-                    entity,
-                )
-                return await TelegramClient.get_entity(self, entity)
+                return None
         else:
             hashable_entity = entity
 
         if str(hashable_entity).isdigit() and int(hashable_entity) < 0:
             hashable_entity = int(str(hashable_entity)[4:])
 
-        if (
-            not force
-            and hashable_entity
-            and hashable_entity in self._hikka_entity_cache
-            and (
-                not exp
-                or self._hikka_entity_cache[hashable_entity].ts + exp > time.time()
-            )
-        ):
-            logger.debug(
-                "Using cached entity %s (%s)",
-                entity,
-                type(self._hikka_entity_cache[hashable_entity].entity).__name__,
-            )
-            return copy.deepcopy(self._hikka_entity_cache[hashable_entity].entity)
+        return hashable_entity
 
+    async def _resolve_entity(
+        self,
+        entity: EntityLike,
+        hashable_entity: typing.Hashable,
+        exp: int,
+    ):
         resolved_entity = await TelegramClient.get_entity(self, entity)
+        self._save_entity(hashable_entity, resolved_entity, exp)
+        return resolved_entity
+
+    def _save_entity(
+        self,
+        hashable_entity: typing.Optional[typing.Hashable],
+        resolved_entity: EntityLike,
+        exp: int,
+    ):
+        if not resolved_entity:
+            return
 
-        if resolved_entity:
-            cache_record = CacheRecordEntity(hashable_entity, resolved_entity, exp)
-            self._hikka_entity_cache[hashable_entity] = cache_record
-            logger.debug("Saved hashable_entity %s to cache", hashable_entity)
+        freeze(resolved_entity)
+        self._cache_record(
+            self._hikka_entity_cache,
+            getattr(resolved_entity, "id", None) or hashable_entity,
+            CacheRecordEntity(hashable_entity, resolved_entity, exp),
+            [hashable_entity, *self._entity_keys(resolved_entity)],
+        )
+        logger.debug("Saved hashable_entity %s to cache", hashable_entity)
 
-            if getattr(resolved_entity, "id", None):
-                logger.debug("Saved resolved_entity id %s to cache", resolved_entity.id)
-                self._hikka_entity_cache[resolved_entity.id] = cache_record
+    @staticmethod
+    def _entity_keys(entity: EntityLike) -> typing.List[typing.Union[str, int]]:
+        """Get keys, which entity can be accessed by in cache"""
+        keys = []
+        if getattr(entity, "id", None):
+            keys += [entity.id]
 
-            if getattr(resolved_entity, "username", None):
-                logger.debug(
-                    "Saved resolved_entity username @%s to cache",
-                    resolved_entity.username,
-                )
-                self._hikka_entity_cache[f"@{resolved_entity.username}"] = cache_record
-                self._hikka_entity_cache[resolved_entity.username] = cache_record
+        if getattr(entity, "username", None):
+            keys += [f"@{entity.username}", entity.username]
 
-        return copy.deepcopy(resolved_entity)
+        return keys
 
     async def get_perms_cached(
         self,
@@ -206,21 +646,21 @@ class CustomTelegramClient(TelegramClient):
         user: typing.Optional[EntityLike] = None,
         exp: int = 5 * 60,
         force: bool = False,
+        mutable: bool = False,
     ):
         """
         Gets the permissions of the user in the entity and cache it
 
         :param entity: Entity to fetch
         :param user: User to fetch
-        :param exp: Expiration time of the cache record and maximum time of already cached record
+        :param exp: Expiration time of the cache record and maximum time of already cached record.
+            `0` means that record never expires and cached record of any age is used
         :param force: Whether to force refresh the cache (make API request)
+        :param mutable: Whether to return a mutable copy of the permissions. Otherwise,
+            the read-only instance, shared with the cache, is returned
         :return: :obj:`ChatPermissions`
         """
 
-        # Will be used to determine, which client caused logging messages
-        # parsed via inspect.stack()
-        _hikka_client_id_logging_tag = copy.copy(self.tg_id)  # noqa: F841
-
         entity = await self.get_entity(entity)
         user = await self.get_entity(user) if user else None
 
@@ -264,58 +704,187 @@ class CustomTelegramClient(TelegramClient):
             not force
             and hashable_entity
             and hashable_user
-            and hashable_user in self._hikka_perms_cache.get(hashable_entity, {})
             and (
-                not exp
-                or self._hikka_perms_cache[hashable_entity][hashable_user].ts + exp
-                > time.time()
+                cache_record := self._hikka_perms_cache.get(
+                    (hashable_entity, hashable_user),
+                    exp,
+                )
             )
         ):
             logger.debug("Using cached perms %s (%s)", hashable_entity, hashable_user)
-            return copy.deepcopy(
-                self._hikka_perms_cache[hashable_entity][hashable_user].perms
-            )
+            return thaw(cache_record.perms) if mutable else cache_record.perms
 
         resolved_perms = await self.get_permissions(entity, user)
 
         if resolved_perms:
-            cache_record = CacheRecordPerms(
-                hashable_entity,
-                hashable_user,
-                resolved_perms,
-                exp,
+            freeze(resolved_perms)
+            self._cache_record(
+                self._hikka_perms_cache,
+                (hashable_entity, hashable_user),
+                CacheRecordPerms(hashable_entity, hashable_user, resolved_perms, exp),
+                [
+                    (entity_key, user_key)
+                    for entity_key in self._entity_keys(entity)
+                    for user_key in self._entity_keys(user)
+                ],
             )
-            self._hikka_perms_cache.setdefault(hashable_entity, {})[
-                hashable_user
-            ] = cache_record
             logger.debug("Saved hashable_entity %s perms to cache", hashable_entity)
 
-            def save_user(key: typing.Union[str, int]):
-                nonlocal self, cache_record, user, hashable_user
-                if getattr(user, "id", None):
-                    self._hikka_perms_cache.setdefault(key, {})[user.id] = cache_record
+        return thaw(resolved_perms) if mutable else resolved_perms
+
+    async def get_chat_participants_cached(
+        self,
+        chat_id: int,
+        exp: int = 5 * 60,
+        force: bool = False,
+    ) -> typing.Dict[int, typing.Any]:
+        """
+        Gets participants of the basic group with a single request and cache them.
+        Cached participants are kept up to date by participant updates
 
-                if getattr(user, "username", None):
-                    self._hikka_perms_cache.setdefault(key, {})[
-                        f"@{user.username}"
-                    ] = cache_record
-                    self._hikka_perms_cache.setdefault(key, {})[
-                        user.username
-                    ] = cache_record
+        :param chat_id: ID of basic group
+        :param exp: Expiration time of the cache record and maximum time of already cached record.
+            `0` means that record never expires and cached record of any age is used
+        :param force: Whether to force refresh the cache (make API request)
+        :return: Participants by user ID. It's shared with the cache, so it must not be modified
+        """
+        if not force and (
+            cache_record := self._hikka_participants_cache.get(chat_id, exp)
+        ):
+            return cache_record.participants
 
-            if getattr(entity, "id", None):
-                logger.debug("Saved resolved_entity id %s perms to cache", entity.id)
-                save_user(entity.id)
+        full_chat = await self._single_flight(
+            ("participants", chat_id),
+            lambda: self(GetFullChatRequest(chat_id)),
+        )
+        participants = full_chat.full_chat.participants
 
-            if getattr(entity, "username", None):
-                logger.debug(
-                    "Saved resolved_entity username @%s perms to cache",
-                    entity.username,
-                )
-                save_user(f"@{entity.username}")
-                save_user(entity.username)
+        if isinstance(participants, ChatParticipants):
+            participants = {
+                participant.user_id: participant
+                for participant in participants.participants
+            }
+        else:
+            # Participants of the chat are hidden from us
+            participants = (
+                {participants.self_participant.user_id: participants.self_participant}
+                if getattr(participants, "self_participant", None)
+                else {}
+            )
+
+        self._cache_record(
+            self._hikka_participants_cache,
+            chat_id,
+            CacheRecordParticipants(chat_id, participants, exp),
+        )
+        logger.debug("Saved %s participants of chat %s", len(participants), chat_id)
+        return participants
+
+    async def get_edit_author_cached(
+        self,
+        message: Message,
+        exp: int = EDIT_LOG_TTL,
+        force: bool = False,
+    ) -> typing.Optional[int]:
+        """
+        Gets the author of the last edit of the channel message from the admin log.
+        Recent edits of the channel are fetched with a single request and cached,
+        so the same edit is resolved without requests until it expires
+
+        :param message: Edited channel message
+        :param exp: Expiration time of the cache record and maximum time of already cached record.
+            `0` means that record never expires and cached record of any age is used
+        :param force: Whether to force refresh the cache (make API request)
+        :return: ID of the editor or `None` if the edit is not in the recent admin log
+        """
+        chat_id = resolve_id(message.chat_id)[0]
+
+        if (
+            not force
+            and (cache_record := self._hikka_edit_log_cache.get(chat_id, exp))
+            and (entry := cache_record.editors.get(message.id))
+            # Message could have been edited once more by someone else
+            and entry[1] == message.edit_date
+        ):
+            logger.debug("Using cached editor of %s in %s", message.id, chat_id)
+            return entry[0]
+
+        async def fetch() -> list:
+            return [
+                event
+                async for event in self.iter_admin_log(chat_id, limit=10, edit=True)
+            ]
+
+        editors = {}
+        for event in await self._single_flight(("edit_log", chat_id), fetch):
+            # Events are ordered from the newest one
+            editors.setdefault(
+                event.action.prev_message.id,
+                (
+                    event.user_id,
+                    getattr(event.action.new_message, "edit_date", None),
+                ),
+            )
 
-        return copy.deepcopy(resolved_perms)
+        editor = editors.get(message.id, (None,))[0]
+        editors[message.id] = (editor, message.edit_date)
+
+        self._cache_record(
+            self._hikka_edit_log_cache,
+            chat_id,
+            CacheRecordEditLog(chat_id, editors, exp),
+        )
+        logger.debug("Saved %s recent edits of %s", len(editors), chat_id)
+        return editor
+
+    def _track_participants(self, update: typing.Any):
+        """Keep participants and perms caches up to date with participant updates"""
+        if isinstance(update, UpdateChannelParticipant):
+            self._hikka_perms_cache.invalidate((update.channel_id, update.user_id))
+            return
+
+        if isinstance(update, UpdateChatParticipants):
+            self._hikka_participants_cache.invalidate(update.participants.chat_id)
+            return
+
+        if not isinstance(
+            update,
+            (
+                UpdateChatParticipantAdd,
+                UpdateChatParticipantAdmin,
+                UpdateChatParticipantDelete,
+            ),
+        ):
+            return
+
+        self._hikka_perms_cache.invalidate((update.chat_id, update.user_id))
+
+        if not (cache_record := self._hikka_participants_cache.peek(update.chat_id)):
+            return
+
+        participants = cache_record.participants
+        if isinstance(update, UpdateChatParticipantAdd):
+            participants[update.user_id] = ChatParticipant(
+                update.user_id,
+                update.inviter_id,
+                update.date,
+            )
+        elif isinstance(update, UpdateChatParticipantDelete):
+            participants.pop(update.user_id, None)
+        elif (participant := participants.get(update.user_id)) is None:
+            self._hikka_participants_cache.invalidate(update.chat_id)
+        else:
+            participants[update.user_id] = (
+                ChatParticipantAdmin if update.is_admin else ChatParticipant
+            )(
+                update.user_id,
+                getattr(participant, "inviter_id", 0),
+                getattr(participant, "date", None),
+            )
+
+        logger.debug(
+            "Updated participant %s of chat %s", update.user_id, update.chat_id
+        )
 
     async def get_fullchannel(
         self,
@@ -327,7 +896,8 @@ class CustomTelegramClient(TelegramClient):
         Gets the FullChannelRequest and cache it
 
         :param entity: Channel to fetch ChannelFull of
-        :param exp: Expiration time of the cache record and maximum time of already cached record
+        :param exp: Expiration time of the cache record and maximum time of already cached record.
+            `0` means that record never expires and cached record of any age is used
         :param force: Whether to force refresh the cache (make API request)
         :return: :obj:`ChannelFull`
         """
@@ -353,19 +923,27 @@ class CustomTelegramClient(TelegramClient):
         if str(hashable_entity).isdigit() and int(hashable_entity) < 0:
             hashable_entity = int(str(hashable_entity)[4:])
 
-        if (
-            not force
-            and self._hikka_fullchannel_cache.get(hashable_entity)
-            and not self._hikka_fullchannel_cache[hashable_entity].expired
-            and self._hikka_fullchannel_cache[hashable_entity].ts + exp > time.time()
+        if not force and (
+            cache_record := self._hikka_fullchannel_cache.get(hashable_entity, exp)
         ):
-            return self._hikka_fullchannel_cache[hashable_entity].full_channel
+            return cache_record.full_channel
 
+        return await self._single_flight(
+            ("fullchannel", hashable_entity),
+            lambda: self._fetch_fullchannel(entity, hashable_entity, exp),
+        )
+
+    async def _fetch_fullchannel(
+        self,
+        entity: EntityLike,
+        hashable_entity: typing.Hashable,
+        exp: int,
+    ) -> ChannelFull:
         result = await self(GetFullChannelRequest(channel=entity))
-        self._hikka_fullchannel_cache[hashable_entity] = CacheRecordFullChannel(
+        self._cache_record(
+            self._hikka_fullchannel_cache,
             hashable_entity,
-            result,
-            exp,
+            CacheRecordFullChannel(hashable_entity, result, exp),
         )
         return result
 
@@ -379,7 +957,8 @@ class CustomTelegramClient(TelegramClient):
         Gets the FullUserRequest and cache it
 
         :param entity: User to fetch UserFull of
-        :param exp: Expiration time of the cache record and maximum time of already cached record
+        :param exp: Expiration time of the cache record and maximum time of already cached record.
+            `0` means that record never expires and cached record of any age is used
         :param force: Whether to force refresh the cache (make API request)
         :return: :obj:`UserFull`
         """
@@ -405,26 +984,34 @@ class CustomTelegramClient(TelegramClient):
         if str(hashable_entity).isdigit() and int(hashable_entity) < 0:
             hashable_entity = int(str(hashable_entity)[4:])
 
-        if (
-            not force
-            and self._hikka_fulluser_cache.get(hashable_entity)
-            and not self._hikka_fulluser_cache[hashable_entity].expired
-            and self._hikka_fulluser_cache[hashable_entity].ts + exp > time.time()
+        if not force and (
+            cache_record := self._hikka_fulluser_cache.get(hashable_entity, exp)
         ):
-            return self._hikka_fulluser_cache[hashable_entity].full_user
+            return cache_record.full_user
 
+        return await self._single_flight(
+            ("fulluser", hashable_entity),
+            lambda: self._fetch_fulluser(entity, hashable_entity, exp),
+        )
+
+    async def _fetch_fulluser(
+        self,
+        entity: EntityLike,
+        hashable_entity: typing.Hashable,
+        exp: int,
+    ) -> UserFull:
         result = await self(GetFullUserRequest(entity))
-        self._hikka_fulluser_cache[hashable_entity] = CacheRecordFullUser(
+        self._cache_record(
+            self._hikka_fulluser_cache,
             hashable_entity,
-            result,
-            exp,
+            CacheRecordFullUser(hashable_entity, result, exp),
         )
         return result
 
     @staticmethod
     def _find_message_obj_in_frame(
         chat_id: int,
-        frame: inspect.FrameInfo,
+        frame: types.FrameType,
     ) -> typing.Optional[Message]:
         """
         Finds the message object from the frame
@@ -433,7 +1020,7 @@ class CustomTelegramClient(TelegramClient):
         return next(
             (
                 obj
-                for obj in frame.frame.f_locals.values()
+                for obj in frame.f_locals.values()
                 if isinstance(obj, Message)
                 and getattr(obj.reply_to, "forum_topic", False)
                 and chat_id == getattr(obj.peer_id, "channel_id", None)
@@ -444,7 +1031,7 @@ class CustomTelegramClient(TelegramClient):
     async def _find_message_obj_in_stack(
         self,
         chat: EntityLike,
-        stack: typing.List[inspect.FrameInfo],
+        stack: typing.List[types.FrameType],
     ) -> typing.Optional[Message]:
         """
         Finds the message object from the stack
@@ -453,9 +1040,9 @@ class CustomTelegramClient(TelegramClient):
         logger.debug("Finding message object in stack for chat %s", chat_id)
         return next(
             (
-                self._find_message_obj_in_frame(chat_id, frame_info)
-                for frame_info in stack
-                if self._find_message_obj_in_frame(chat_id, frame_info)
+                self._find_message_obj_in_frame(chat_id, frame)
+                for frame in stack
+                if self._find_message_obj_in_frame(chat_id, frame)
             ),
             None,
         )
@@ -463,7 +1050,7 @@ class CustomTelegramClient(TelegramClient):
     async def _find_topic_in_stack(
         self,
         chat: EntityLike,
-        stack: typing.List[inspect.FrameInfo],
+        stack: typing.List[types.FrameType],
     ) -> typing.Optional[Message]:
         """
         Finds the message object from the stack
@@ -478,7 +1065,6 @@ class CustomTelegramClient(TelegramClient):
     async def _topic_guesser(
         self,
         native_method: typing.Callable[..., typing.Awaitable[Message]],
-        stack: typing.List[inspect.FrameInfo],
         *args,
         **kwargs,
     ):
@@ -491,7 +1077,20 @@ class CustomTelegramClient(TelegramClient):
 
             logger.debug("Topic deleted, trying to guess topic id")
 
-            topic = await self._find_topic_in_stack(args[0], stack)
+            # Stack is captured only on failure. Callers are still awaiting
+            # this coroutine, so their frames are the same as they were on send.
+            # Frames are walked directly, because `inspect.stack()`
+            # reads source code of each frame, which is very slow
+            stack = []
+            frame = inspect.currentframe()
+            while frame:
+                stack += [frame]
+                frame = frame.f_back
+
+            try:
+                topic = await self._find_topic_in_stack(args[0], stack)
+            finally:
+                del stack, frame
 
             logger.debug("Guessed topic id: %s", topic)
 
@@ -500,23 +1099,13 @@ class CustomTelegramClient(TelegramClient):
 
             kwargs["reply_to"] = topic
             kwargs["_topic_no_retry"] = True
-            return await self._topic_guesser(native_method, stack, *args, **kwargs)
+            return await self._topic_guesser(native_method, *args, **kwargs)
 
     async def send_file(self, *args, **kwargs) -> Message:
-        return await self._topic_guesser(
-            TelegramClient.send_file,
-            inspect.stack(),
-            *args,
-            **kwargs,
-        )
+        return await self._topic_guesser(TelegramClient.send_file, *args, **kwargs)
 
     async def send_message(self, *args, **kwargs) -> Message:
-        return await self._topic_guesser(
-            TelegramClient.send_message,
-            inspect.stack(),
-            *args,
-            **kwargs,
-        )
+        return await self._topic_guesser(TelegramClient.send_message, *args, **kwargs)
 
     async def _call(
         self,
@@ -551,20 +1140,9 @@ class CustomTelegramClient(TelegramClient):
         new_request = []
 
         for item in request:
-            if item.CONSTRUCTOR_ID in self._forbidden_constructors and next(
-                (
-                    frame_info.frame.f_locals["self"]
-                    for frame_info in inspect.stack()
-                    if hasattr(frame_info, "frame")
-                    and hasattr(frame_info.frame, "f_locals")
-                    and isinstance(frame_info.frame.f_locals, dict)
-                    and "self" in frame_info.frame.f_locals
-                    and isinstance(frame_info.frame.f_locals["self"], Module)
-                    and not getattr(
-                        frame_info.frame.f_locals["self"], "__origin__", ""
-                    ).startswith("<core")
-                ),
-                None,
+            if (
+                item.CONSTRUCTOR_ID in self._forbidden_constructors
+                and self._is_external_module_call()
             ):
                 logger.debug(
                     "🎉 I protected you from unintented %s (%s)!",
@@ -586,14 +1164,41 @@ class CustomTelegramClient(TelegramClient):
             flood_sleep_threshold,
         )
 
+    @staticmethod
+    def _is_external_module_call() -> bool:
+        """Whether the request is made by a non-core module"""
+        module = current_module.get()
+        if module is not None and not getattr(module, "__origin__", "").startswith(
+            "<core"
+        ):
+            return True
+
+        # Context is either unknown (e.g. tasks created outside of handlers)
+        # or core one, which third-party code can still run under, e.g.
+        # module's `__init__` during `loadmod` and tasks, created by it.
+        # Any non-core module on the stack makes the call external. Frames
+        # are walked directly, because `inspect.stack()` reads source code
+        frame = inspect.currentframe()
+        try:
+            while frame:
+                if isinstance(
+                    module := frame.f_locals.get("self"), Module
+                ) and not getattr(module, "__origin__", "").startswith("<core"):
+                    return True
+
+                frame = frame.f_back
+        finally:
+            del frame
+
+        return False
+
     def forbid_constructor(self, constructor: int):
         """
         Forbids the given constructor to be called
 
         :param constructor: Constructor id to forbid
         """
-        self._forbidden_constructors.extend([constructor])
-        self._forbidden_constructors = list(set(self._forbidden_constructors))
+        self._forbidden_constructors |= {constructor}
 
     def forbid_constructors(self, constructors: list):
         """
@@ -602,7 +1207,7 @@ class CustomTelegramClient(TelegramClient):
 
         :param constructors: Constructor ids to forbid
         """
-        self._forbidden_constructors = list(set(constructors))
+        self._forbidden_constructors = frozenset(constructors)
 
     def _handle_update(
         self: "CustomTelegramClient",
@@ -611,4 +1216,11 @@ class CustomTelegramClient(TelegramClient):
         if self._raw_updates_processor is not None:
             self._raw_updates_processor(update)
 
+        for inner_update in (
+            [update.update]
+            if isinstance(update, UpdateShort)
+            else getattr(update, "updates", [])
+        ):
+            self._track_participants(inner_update)
+
         super()._handle_update(update)
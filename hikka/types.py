@@ -7,6 +7,7 @@
 
 import ast
 import asyncio
+import collections
 import contextlib
 import copy
 import importlib
@@ -16,6 +17,7 @@ import inspect
 import logging
 import os
 import re
+import shlex
 import sys
 import time
 import typing
@@ -265,9 +267,6 @@ class Module:
         """
         from . import utils
 
-        with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
-
         if interval < 0.1:
             logger.warning(
                 "Resetting animation interval to 0.1s, because it may get you in"
@@ -997,10 +996,14 @@ class ConfigValue:
         object.__setattr__(self, key, value)
 
         if key == "value" and not ignore_validation and callable(self.on_change):
-            if inspect.iscoroutinefunction(self.on_change):
-                asyncio.ensure_future(wrap(self.on_change))
-            else:
-                syncwrap(self.on_change)
+            from ._context import enter_module, get_module  # Avoiding circular import
+
+            module = get_module(self.on_change)
+            with enter_module(module) if module else contextlib.nullcontext():
+                if inspect.iscoroutinefunction(self.on_change):
+                    asyncio.ensure_future(wrap(self.on_change))
+                else:
+                    syncwrap(self.on_change)
 
 
 def _get_members(
@@ -1034,14 +1037,14 @@ class CacheRecordEntity:
         resolved_entity: EntityLike,
         exp: int,
     ):
-        self.entity = copy.deepcopy(resolved_entity)
+        self.entity = resolved_entity
         self._hashable_entity = copy.deepcopy(hashable_entity)
-        self._exp = round(time.time() + exp)
+        self._exp = round(time.time() + exp) if exp else None
         self.ts = time.time()
 
     @property
     def expired(self) -> bool:
-        return self._exp < time.time()
+        return self._exp is not None and self._exp < time.time()
 
     def __eq__(self, record: "CacheRecordEntity") -> bool:
         return hash(record) == hash(self)
@@ -1067,15 +1070,15 @@ class CacheRecordPerms:
         resolved_perms: EntityLike,
         exp: int,
     ):
-        self.perms = copy.deepcopy(resolved_perms)
+        self.perms = resolved_perms
         self._hashable_entity = copy.deepcopy(hashable_entity)
         self._hashable_user = copy.deepcopy(hashable_user)
-        self._exp = round(time.time() + exp)
+        self._exp = round(time.time() + exp) if exp else None
         self.ts = time.time()
 
     @property
     def expired(self) -> bool:
-        return self._exp < time.time()
+        return self._exp is not None and self._exp < time.time()
 
     def __eq__(self, record: "CacheRecordPerms") -> bool:
         return hash(record) == hash(self)
@@ -1096,12 +1099,12 @@ class CacheRecordFullChannel:
     def __init__(self, channel_id: int, full_channel: ChannelFull, exp: int):
         self.channel_id = channel_id
         self.full_channel = full_channel
-        self._exp = round(time.time() + exp)
+        self._exp = round(time.time() + exp) if exp else None
         self.ts = time.time()
 
     @property
     def expired(self) -> bool:
-        return self._exp < time.time()
+        return self._exp is not None and self._exp < time.time()
 
     def __eq__(self, record: "CacheRecordFullChannel") -> bool:
         return hash(record) == hash(self)
@@ -1123,12 +1126,12 @@ class CacheRecordFullUser:
     def __init__(self, user_id: int, full_user: UserFull, exp: int):
         self.user_id = user_id
         self.full_user = full_user
-        self._exp = round(time.time() + exp)
+        self._exp = round(time.time() + exp) if exp else None
         self.ts = time.time()
 
     @property
     def expired(self) -> bool:
-        return self._exp < time.time()
+        return self._exp is not None and self._exp < time.time()
 
     def __eq__(self, record: "CacheRecordFullUser") -> bool:
         return hash(record) == hash(self)
@@ -1143,6 +1146,428 @@ class CacheRecordFullUser:
         return f"CacheRecordFullUser(channel_id={self.user_id}(...), exp={self._exp})"
 
 
+class CacheRecordParticipants:
+    def __init__(
+        self,
+        chat_id: int,
+        participants: typing.Dict[int, typing.Any],
+        exp: int,
+    ):
+        self.chat_id = chat_id
+        self.participants = participants
+        self._exp = round(time.time() + exp) if exp else None
+        self.ts = time.time()
+
+    @property
+    def expired(self) -> bool:
+        return self._exp is not None and self._exp < time.time()
+
+    def __str__(self) -> str:
+        return f"CacheRecordParticipants of {self.chat_id}"
+
+    def __repr__(self) -> str:
+        return (
+            f"CacheRecordParticipants(chat_id={self.chat_id},"
+            f" participants={len(self.participants)}, exp={self._exp})"
+        )
+
+
+class CacheRecordEditLog:
+    def __init__(
+        self,
+        chat_id: int,
+        editors: typing.Dict[int, typing.Tuple[typing.Optional[int], typing.Any]],
+        exp: int,
+    ):
+        self.chat_id = chat_id
+        self.editors = editors
+        self._exp = round(time.time() + exp) if exp else None
+        self.ts = time.time()
+
+    @property
+    def expired(self) -> bool:
+        return self._exp is not None and self._exp < time.time()
+
+    def __str__(self) -> str:
+        return f"CacheRecordEditLog of {self.chat_id}"
+
+    def __repr__(self) -> str:
+        return (
+            f"CacheRecordEditLog(chat_id={self.chat_id},"
+            f" editors={len(self.editors)}, exp={self._exp})"
+        )
+
+
+class RateLimiter:
+    """
+    Token bucket rate limiter.
+    Tokens are refilled lazily on access, so no timers are scheduled.
+    Only `max_keys` recently used keys are tracked, the least recently
+    used ones are forgotten, which is the same as a full bucket
+    """
+
+    def __init__(self, capacity: float, rate: float, max_keys: int = 10000):
+        """
+        :param capacity: Maximum amount of tokens in bucket
+        :param rate: Amount of tokens, refilled per second
+        :param max_keys: Maximum amount of tracked keys
+        """
+        self.capacity = capacity
+        self.rate = rate
+        self.max_keys = max_keys
+        self.allowed = 0
+        self.throttled = 0
+        self.evicted = 0
+        self._buckets: typing.OrderedDict[
+            typing.Hashable,
+            typing.Tuple[float, float],
+        ] = collections.OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def tokens(self, key: typing.Hashable, now: typing.Optional[float] = None) -> float:
+        """Get current amount of tokens in bucket of `key`"""
+        if (bucket := self._buckets.get(key)) is None:
+            return self.capacity
+
+        tokens, ts = bucket
+        return min(self.capacity, tokens + ((now or time.monotonic()) - ts) * self.rate)
+
+    def can_consume(
+        self,
+        key: typing.Hashable,
+        cost: float = 1,
+        now: typing.Optional[float] = None,
+    ) -> bool:
+        return self.tokens(key, now) >= cost
+
+    def consume(
+        self,
+        key: typing.Hashable,
+        cost: float = 1,
+        now: typing.Optional[float] = None,
+    ) -> bool:
+        """
+        Take `cost` tokens from bucket of `key`
+        :return: `True` if there were enough tokens, `False` if call is throttled
+        """
+        now = now or time.monotonic()
+        tokens = self.tokens(key, now)
+
+        if tokens < cost:
+            self.throttled += 1
+            return False
+
+        self.allowed += 1
+        self._buckets[key] = (tokens - cost, now)
+        self._buckets.move_to_end(key)
+
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+            self.evicted += 1
+
+        return True
+
+    def reject(self):
+        """Count the call as throttled without taking tokens"""
+        self.throttled += 1
+
+    @property
+    def stats(self) -> typing.Dict[str, int]:
+        return {
+            "tracked": len(self._buckets),
+            "allowed": self.allowed,
+            "throttled": self.throttled,
+            "evicted": self.evicted,
+        }
+
+
+class TTLCache:
+    """
+    Bounded cache of records with `ts` attribute and `expired` property,
+    e.g. `CacheRecordEntity`. Expired records are dropped on access and by
+    `sweep`, least recently used ones are evicted, when the cache is full.
+    Records, created with `exp=0`, never expire.
+    Record can be accessed by several keys (e.g. id and username of entity),
+    which take a single slot in the cache
+    """
+
+    def __init__(self, max_size: int):
+        """
+        :param max_size: Maximum amount of records in cache
+        """
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self._records: typing.OrderedDict[
+            typing.Hashable,
+            typing.Any,
+        ] = collections.OrderedDict()
+        self._aliases: typing.Dict[typing.Hashable, typing.Hashable] = {}
+        self._record_aliases: typing.Dict[
+            typing.Hashable,
+            typing.Set[typing.Hashable],
+        ] = {}
+
+    def _drop(self, key: typing.Hashable):
+        self._records.pop(key, None)
+        for alias in self._record_aliases.pop(key, ()):
+            if self._aliases.get(alias) == key:
+                del self._aliases[alias]
+
+    def _unalias(self, alias: typing.Hashable):
+        if (key := self._aliases.pop(alias, None)) is not None:
+            self._record_aliases[key].discard(alias)
+
+    def get(
+        self,
+        key: typing.Hashable,
+        max_age: typing.Optional[float] = None,
+    ) -> typing.Optional[typing.Any]:
+        """
+        Get record from cache
+        :param key: Key or alias of record
+        :param max_age: Maximum age of record in seconds. If not passed,
+            record is returned until it expires. `0` means that record
+            of any age is returned, even if it has expired, but not swept yet
+        :return: Record or `None` if it's missing, expired or too old
+        """
+        key = self._aliases.get(key, key)
+        record = self._records.get(key)
+
+        if record is not None and max_age != 0 and record.expired:
+            self._drop(key)
+            self.expirations += 1
+            record = None
+
+        if record is None or max_age and record.ts + max_age <= time.time():
+            self.misses += 1
+            return None
+
+        self._records.move_to_end(key)
+        self.hits += 1
+        return record
+
+    def peek(self, key: typing.Hashable) -> typing.Optional[typing.Any]:
+        """
+        Get record from cache without counting the access in stats
+        and without changing its position in eviction order
+        :param key: Key or alias of record
+        :return: Record or `None` if it's missing or expired
+        """
+        record = self._records.get(self._aliases.get(key, key))
+        return None if record is None or record.expired else record
+
+    def invalidate(self, key: typing.Hashable) -> bool:
+        """
+        Drop record from cache, e.g. when it's known to be outdated
+        :param key: Key or alias of record
+        :return: `True` if record was in cache
+        """
+        if (key := self._aliases.get(key, key)) not in self._records:
+            return False
+
+        self._drop(key)
+        return True
+
+    def set(
+        self,
+        key: typing.Hashable,
+        record: typing.Any,
+        aliases: typing.Iterable[typing.Hashable] = (),
+    ):
+        """
+        Put record to cache
+        :param key: Main key of record
+        :param record: Record to save
+        :param aliases: Additional keys, which record can be accessed by
+        """
+        aliases = {alias for alias in aliases if alias is not None} - {key}
+
+        for alias in {key, *aliases}:
+            # Alias could have belonged to another record, e.g.
+            # if username was taken by someone else
+            self._unalias(alias)
+            self._drop(alias)
+
+        self._records[key] = record
+        self._record_aliases[key] = aliases
+        for alias in aliases:
+            self._aliases[alias] = key
+
+        while len(self._records) > self.max_size:
+            self._drop(next(iter(self._records)))
+            self.evictions += 1
+
+    def sweep(self) -> int:
+        """
+        Drop all expired records
+        :return: Amount of dropped records
+        """
+        expired = [key for key, record in self._records.items() if record.expired]
+        for key in expired:
+            self._drop(key)
+
+        self.expirations += len(expired)
+        return len(expired)
+
+    def items(
+        self,
+    ) -> typing.Iterator[
+        typing.Tuple[typing.Hashable, typing.Any, typing.Set[typing.Hashable]]
+    ]:
+        """Iterate over records, which are not expired, with their keys and aliases"""
+        for key, record in list(self._records.items()):
+            if not record.expired:
+                yield key, record, self._record_aliases[key]
+
+    def clear(self):
+        self._records.clear()
+        self._aliases.clear()
+        self._record_aliases.clear()
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        record = self._records.get(self._aliases.get(key, key))
+        return record is not None and not record.expired
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    @property
+    def stats(self) -> typing.Dict[str, typing.Union[int, float]]:
+        return {
+            "size": len(self._records),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hit_rate": (
+                self.hits / (self.hits + self.misses)
+                if self.hits + self.misses
+                else 0.0
+            ),
+        }
+
+
+class ParsedCommand:
+    """
+    Command, parsed from the message text once. It's attached to the message
+    as `hikka_command` and reused by dispatcher, security and `utils.get_args*`
+    as long as the text of message is not changed
+    """
+
+    def __init__(
+        self,
+        text: str,
+        prefix: str,
+        command: str,
+        name: str,
+        username: typing.Optional[str],
+        resolved: str,
+        func: typing.Optional[Command],
+    ):
+        """
+        :param text: Text of message, which the command is parsed from
+        :param prefix: Command prefix
+        :param command: Command as it was typed, e.g. `help@username`
+        :param name: Command without username
+        :param username: Username, which command is addressed to, if any
+        :param resolved: Name of command with aliases resolved
+        :param func: Command handler or `None` if command is not found
+        """
+        self.text = text
+        self.prefix = prefix
+        self.command = command
+        self.name = name
+        self.username = username
+        self.resolved = resolved
+        self.func = func
+        self._args: typing.Optional[str] = None
+        self._split_args: typing.Optional[typing.Union[typing.Tuple[str, ...], str]] = (
+            None
+        )
+
+    @classmethod
+    def parse(
+        cls,
+        text: str,
+        prefix: str,
+        dispatch: typing.Callable[[str], typing.Tuple[str, typing.Optional[Command]]],
+    ) -> "ParsedCommand":
+        """
+        :param text: Text of message, starting with prefix
+        :param prefix: Command prefix
+        :param dispatch: Function to resolve command name and handler
+        """
+        command = text[1:].strip().split(maxsplit=1)[0]
+        name, *username = command.split("@", maxsplit=1)
+        resolved, func = dispatch(name)
+        return cls(
+            text,
+            prefix,
+            command,
+            name,
+            username[0] if username else None,
+            resolved,
+            func,
+        )
+
+    def resolve(self, text: str) -> "ParsedCommand":
+        """
+        Get the parse of new text of message, where command
+        is replaced with its resolved name
+        :param text: New text of message
+        """
+        return ParsedCommand(
+            text,
+            self.prefix,
+            self.resolved,
+            self.resolved,
+            None,
+            self.resolved,
+            self.func,
+        )
+
+    def is_valid_for(self, message: typing.Any) -> bool:
+        """Whether the parse is still actual for the message"""
+        return getattr(message, "message", None) is self.text
+
+    @property
+    def args(self) -> str:
+        """Arguments of command as raw string, like `utils.get_args_raw`"""
+        if self._args is None:
+            self._args = args[1] if len(args := self.text.split(maxsplit=1)) > 1 else ""
+
+        return self._args
+
+    @property
+    def split_args(self) -> typing.Union[typing.List[str], str]:
+        """Arguments of command split like in shell, like `utils.get_args`"""
+        if self._split_args is None:
+            try:
+                self._split_args = tuple(arg for arg in shlex.split(self.args) if arg)
+            except ValueError:
+                # Cannot split, let's assume that it's just one long message
+                self._split_args = self.args
+
+        # Caller may modify the list, so the cached value is not shared
+        return (
+            list(self._split_args)
+            if isinstance(self._split_args, tuple)
+            else self._split_args
+        )
+
+    def __repr__(self) -> str:
+        return (
+            f"ParsedCommand(command={self.command!r}, resolved={self.resolved!r},"
+            f" args={self.args!r})"
+        )
+
+
 def get_commands(mod: Module) -> dict:
     """Introspect the module to get its commands"""
     return _get_members(mod, "cmd", "is_command")
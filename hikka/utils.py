@@ -66,6 +66,7 @@ from hikkatl.tl.types import (
     ChatAdminRights,
     InputDocument,
     InputPeerNotifySettings,
+    InputPhoneContact,
     MessageEntityBankCard,
     MessageEntityBlockquote,
     MessageEntityBold,
@@ -89,14 +90,17 @@ from hikkatl.tl.types import (
     PeerChannel,
     PeerChat,
     PeerUser,
+    SavedPhoneContact,
     UpdateNewChannelMessage,
+    UpdateUserPhone,
     User,
 )
 
+from ._context import current_command
 from ._internal import fw_protect
 from .inline.types import InlineCall, InlineMessage
 from .tl_cache import CustomTelegramClient
-from .types import HikkaReplyMarkup, ListLike, Module
+from .types import HikkaReplyMarkup, ListLike
 
 FormattingEntity = typing.Union[
     MessageEntityUnknown,
@@ -140,6 +144,11 @@ def get_args(message: typing.Union[Message, str]) -> typing.List[str]:
     :param message: Message or string to get arguments from
     :return: List of arguments
     """
+    if (parsed := getattr(message, "hikka_command", None)) and parsed.is_valid_for(
+        message
+    ):
+        return parsed.split_args
+
     if not (message := getattr(message, "message", message)):
         return False
 
@@ -162,6 +171,11 @@ def get_args_raw(message: typing.Union[Message, str]) -> str:
     :param message: Message or string to get arguments from
     :return: Raw string of arguments
     """
+    if (parsed := getattr(message, "hikka_command", None)) and parsed.is_valid_for(
+        message
+    ):
+        return parsed.args
+
     if not (message := getattr(message, "message", message)):
         return False
 
@@ -348,6 +362,30 @@ def censor(
     return obj
 
 
+# TL types, which carry phone number in the `phone` field
+PHONE_CARRIERS = (User, InputPhoneContact, SavedPhoneContact, UpdateUserPhone)
+
+
+def censor_phones(
+    obj: typing.Any,
+    replace_with: str = "redacted_{count}_chars",
+) -> typing.Any:
+    """
+    Faster alternative of :func:`censor` for messages and events.
+    Telegram references users in messages by id, so instead of walking
+    the whole object graph only the object itself and the raw update
+    of event are checked against the TL types carrying phone numbers
+    :param obj: Message or event to censor
+    :param replace_with: String to replace with, {count} will be replaced with the number of characters
+    :return: Censored object
+    """
+    for value in (obj, getattr(obj, "original_update", None)):
+        if isinstance(value, PHONE_CARRIERS) and isinstance(value.phone, str):
+            value.phone = replace_with.format(count=len(value.phone))
+
+    return obj
+
+
 def relocate_entities(
     entities: typing.List[FormattingEntity],
     offset: int,
@@ -1402,48 +1440,11 @@ def find_caller(
     stack: typing.Optional[typing.List[inspect.FrameInfo]] = None,
 ) -> typing.Any:
     """
-    Attempts to find command in stack
-    :param stack: Stack to search in
+    Attempts to find command, which is currently running
+    :param stack: Unused, kept for backward compatibility
     :return: Command-caller or None
     """
-    caller = next(
-        (
-            frame_info
-            for frame_info in stack or inspect.stack()
-            if hasattr(frame_info, "function")
-            and any(
-                inspect.isclass(cls_)
-                and issubclass(cls_, Module)
-                and cls_ is not Module
-                for cls_ in frame_info.frame.f_globals.values()
-            )
-        ),
-        None,
-    )
-
-    if not caller:
-        return next(
-            (
-                frame_info.frame.f_locals["func"]
-                for frame_info in stack or inspect.stack()
-                if hasattr(frame_info, "function")
-                and frame_info.function == "future_dispatcher"
-                and (
-                    "CommandDispatcher"
-                    in getattr(getattr(frame_info, "frame", None), "f_globals", {})
-                )
-            ),
-            None,
-        )
-
-    return next(
-        (
-            getattr(cls_, caller.function, None)
-            for cls_ in caller.frame.f_globals.values()
-            if inspect.isclass(cls_) and issubclass(cls_, Module)
-        ),
-        None,
-    )
+    return current_command.get()
 
 
 def validate_html(html: str) -> str: